@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'meetup.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после настройки Django: модуль бота тянет модели
+from meetup_bot.webhook import webhook  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django не обрабатывает lifespan, поэтому запуск и остановку бота
+    # в воркере берём на себя. Бот поднимается, только если настроен
+    # webhook. Воркер тогда должен быть один: кэши бота живут в памяти
+    # процесса, второй воркер не стартует, см. ProcessLock
+    if scope['type'] == 'lifespan':
+        await webhook.lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -79,9 +79,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            # WAL: читатели не ждут писателя; NORMAL в WAL не делает fsync
+            # на каждый коммит
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            # busy_timeout в секундах: ждём блокировку
+            # вместо «database is locked»
+            'timeout': 20,
+            # Транзакция сразу берёт блокировку записи и не падает
+            # при её повышении
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Соединения живут дольше запроса и проверяются перед повторным
+        # использованием
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # Тестовая БД — файл, чтобы WAL и поток писателя работали как в бою
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Та же БД только на чтение: сюда DATABASE_ROUTERS отправляет чтения
+    'readonly': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA query_only=1;'
+            ),
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
 
+DATABASE_ROUTERS = ['meetup_bot.routers.ReadWriteRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -128,3 +174,72 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 load_dotenv()
 BOT_TOKEN = os.environ['BOT_TOKEN']
 PAYMENT_PROVIDER_TOKEN = os.environ['PAYMENT_PROVIDER_TOKEN']
+
+# Рассылки: глобальный лимит Telegram ~30 сообщений в секунду
+MAILING_RATE_LIMIT = 30
+MAILING_CONCURRENCY = 30
+MAILING_REPORT_BATCH_SIZE = 500
+MAILING_REPORT_FLUSH_INTERVAL = 2  # секунды
+MAILING_CHUNK_SIZE = 500
+MAILING_LEASE_SECONDS = 300
+
+# Кэш пользователей бота по telegram_id
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 60  # секунды
+PROGRAM_CACHE_TTL = 300  # секунды
+SCHEDULE_TTL = 30  # секунды до перечитывания расписания дня из БД
+PROGRAM_PAGE_SIZE = 8
+
+# Очередь вопросов к докладам
+QUESTION_BATCH_SIZE = 200
+QUESTION_FLUSH_INTERVAL = 1  # секунды
+QUESTION_QUEUE_SIZE = 5000
+QUESTION_DIGEST_INTERVAL = 10  # секунды между сообщениями спикеру
+SPEAKER_QUESTIONS_PAGE_SIZE = 10
+SPEAKER_CLUSTERS_LIMIT = 15
+# Как часто забываем кластеры и голоса закончившихся докладов
+TALK_STATE_GC_INTERVAL = 60  # секунды
+
+# Голосование за вопросы
+VOTE_BATCH_SIZE = 500
+VOTE_FLUSH_INTERVAL = 2  # секунды
+QUESTION_TOP_SIZE = 10
+
+# Состояния FSM бота хранятся в БД, впереди — кэш в памяти
+# на FSM_CACHE_SIZE чатов
+FSM_STATE_TTL = 86400  # секунды
+FSM_CACHE_SIZE = 10000
+
+# Webhook: Telegram шлёт апдейты на WEBHOOK_URL (путь bot/webhook/)
+# с секретным заголовком.
+# Бот — один процесс на БД (runbot или один ASGI-воркер): его кэши в памяти.
+# Правки из админки в другом процессе бот увидит по истечении
+# USER_CACHE_TTL, PROGRAM_CACHE_TTL и SCHEDULE_TTL
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONNECTIONS = 100
+
+# Метрики Prometheus: при polling их отдаёт процесс бота
+# на METRICS_HOST:METRICS_PORT/metrics (0 — не отдавать), при webhook —
+# Django по metrics/. Доступ с заголовком Authorization: Bearer
+# METRICS_TOKEN, в Django ещё и сотрудникам из админки
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Обработка апдейтов: порядок внутри чата, параллельно между чатами
+UPDATE_CONCURRENCY = 100
+UPDATE_BACKLOG = 10000
+UPDATE_CHAT_BACKLOG = 20
+# Секунды ожидания места в очереди до сброса апдейта
+UPDATE_SHED_TIMEOUT = 5
+
+# Единственный писатель в БД: размер пачки операций в одной транзакции
+# и очередь
+DB_WRITER_BATCH_SIZE = 100
+DB_WRITER_QUEUE_SIZE = 10000
+# Секунды между проверками долгоживущих соединений бота
+DB_MAINTENANCE_INTERVAL = 60
+
+# Запись входящих апдейтов для replayupdates; пустой путь — запись выключена
+UPDATE_RECORD_PATH = os.environ.get('UPDATE_RECORD_PATH', '')
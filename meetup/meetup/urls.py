@@ -17,6 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from meetup_bot.views import prometheus_metrics, telegram_webhook
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('bot/webhook/', telegram_webhook),
+    path('metrics/', prometheus_metrics),
 ]
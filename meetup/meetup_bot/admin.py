@@ -1,12 +1,21 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.urls import path
+from django.urls import path, reverse
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.http import Http404, JsonResponse
 
 # from .tasks import run_broadcast_message
 
-from .models import CustomUser, Event, Talk, Question, Mailing, MailingReport
+from .models import (
+    CustomUser,
+    Event,
+    Talk,
+    Question,
+    Mailing,
+    MailingReport,
+    MailingJob
+)
 
 
 @admin.register(CustomUser)
@@ -63,15 +72,70 @@ class MailingReportInline(admin.TabularInline):  # или admin.StackedInline
 # Настройка админки для Mailing
 @admin.register(Mailing)
 class MailingAdmin(admin.ModelAdmin):
-    list_display = ('created_at', 'status_summary')  # Добавим сводку по статусам
+    # Добавим сводку по статусам
+    list_display = ('created_at', 'segment', 'status_summary', 'progress')
+    list_filter = ('segment',)
+    raw_id_fields = ('event', 'talk')
     inlines = (MailingReportInline,)  # Подключаем Inline
     search_fields = ('text', 'users__username')  # Поиск по тексту и пользователям
+    readonly_fields = (
+        'sent_count', 'failed_count', 'pending_count', 'progress'
+    )
     # autocomplete_fields = ('users',)
 
-    # Метод для отображения сводки по статусам в списке рассылок
+    # Сводка читается из счётчиков рассылки, без запросов на каждую строку
     def status_summary(self, obj):
-        reports = obj.mailingreport_set.all()
-        success = reports.filter(status='Success').count()
-        fails = reports.filter(status='Fail').count()
-        return f"✅{success} ❌{fails}"
+        return f"✅{obj.sent_count} ❌{obj.failed_count} ⏳{obj.pending_count}"
     status_summary.short_description = 'Статусы'
+
+    # Счётчики обновляются по ходу рассылки, полоску на странице
+    # раз в несколько секунд подтягивает mailing_progress.js
+    def progress(self, obj):
+        done = obj.sent_count + obj.failed_count
+        total = done + obj.pending_count
+        if not obj.pk or not total:
+            return '—'
+        url = reverse('admin:meetup_bot_mailing_progress', args=[obj.pk])
+        return format_html(
+            '<span class="mailing-progress" data-url="{}">'
+            '<progress value="{}" max="{}"></progress> '
+            '<span>{}%</span></span>',
+            url, done, total, done * 100 // total
+        )
+    progress.short_description = 'Прогресс'
+
+    def get_urls(self):
+        urls = [
+            path(
+                '<path:object_id>/progress/',
+                self.admin_site.admin_view(self.progress_view),
+                name='meetup_bot_mailing_progress'
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def progress_view(self, request, object_id):
+        mailing = self.get_object(request, object_id)
+        if mailing is None or not self.has_view_permission(request, mailing):
+            raise Http404
+        return JsonResponse({
+            'sent': mailing.sent_count,
+            'failed': mailing.failed_count,
+            'pending': mailing.pending_count,
+        })
+
+    class Media:
+        js = ('meetup_bot/mailing_progress.js',)
+
+
+@admin.register(MailingJob)
+class MailingJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'mailing', 'status', 'cursor', 'locked_by', 'leased_until',
+        'finished_at'
+    )
+    list_filter = ('status',)
+    readonly_fields = (
+        'mailing', 'cursor', 'locked_by', 'leased_until', 'error',
+        'finished_at'
+    )
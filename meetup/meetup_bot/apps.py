@@ -8,3 +8,4 @@ class MeetupBotConfig(AppConfig):
     def ready(self):
         print('bot started')
         import meetup_bot.bot 
+        import meetup_bot.signals  # noqa: F401
@@ -1,42 +1,56 @@
+import asyncio
+from datetime import datetime
+from html import escape
+import json
+
 from django.conf import settings
 from django.utils import timezone
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
-from aiogram import Bot, Dispatcher, Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import LabeledPrice, PreCheckoutQuery, Message
 from aiogram.enums.parse_mode import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
-from asgiref.sync import sync_to_async
-import asyncio
 
 
 from .models import (
     Mailing,
-    MailingReport,
-    Talk,
-    get_user,
+    Question,
+    enqueue_mailing,
     create_user,
-    get_program,
     get_talk,
-    create_question,
-    get_current_talks,
     start_talk,
     end_talk,
-    get_speaker_questions
+    get_new_questions,
+    get_question_page,
+    load_question_texts,
+    get_questions_by_ids
 )
+from .buffers import WriteBehindBuffer
+from .clustering import ClusterRegistry
+from .dispatcher import OrderedDispatcher
+from . import metrics
+from .metrics import MetricsMiddleware, TelegramMetricsMiddleware
+from .middlewares import UpdateRecorder, UserMiddleware
+from .notifier import MESSAGE_LIMIT, QuestionNotifier, count_fitting
+from .program import get_program_snapshot, get_program_page_snapshot
+from .schedule import get_schedule
+from .singleton import ProcessLock
+from .storage import DjangoStorage
+from .votes import VoteAggregator
+from .writer import db_writer, maintain_connections
 from .keyboards import (
         start_keyboard,
         guest_keyboard,
         start_speaker_keyboard,
         get_talk_inline_keyboard,
-        get_program_inline_keyboard,
         back_keyboard,
         start_talk_keyboard,
         end_talk_keyboard,
-        get_program_keyboard_for_speaker
+        get_questions_keyboard,
+        get_votes_keyboard
 )
 
 router = Router()
@@ -87,8 +101,7 @@ async def register_user(callback):
 
 # Войти
 @router.callback_query(F.data == "login")
-async def check_registration(callback):
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
+async def check_registration(callback, user):
     if not user:
         await callback.message.edit_text(
             "Вы не зарегистрированы. Пожалуйста, зарегистрируйтесь.",
@@ -114,9 +127,9 @@ def format_datetime(dt):
 # Получить программу мероприятия
 @router.callback_query(F.data == "event_program")
 async def get_event_program(callback):
-    event, talks = await get_program()
+    program = await get_program_snapshot()
 
-    if not event:
+    if not program:
         await callback.message.edit_text(
             "Программа отсутствует",
             reply_markup=back_keyboard
@@ -124,20 +137,10 @@ async def get_event_program(callback):
         await callback.answer()
         return
 
-    start_date = timezone.localtime(event.start_date).strftime("%d.%m.%Y %H:%M")
-    end_date = timezone.localtime(event.end_date).strftime("%d.%m.%Y %H:%M")
-
-    event_description = (
-        f"Мероприятие: {event.title}\n"
-        f"Описание: {event.description}\n"
-        f"Дата начала: {start_date}\n"
-        f"Дата окончания: {end_date}\n\n"
-    )
-
-    if talks:
+    if program.page.talks:
         await callback.message.edit_text(
-            event_description,
-            reply_markup=get_program_inline_keyboard(talks)
+            program.description,
+            reply_markup=program.page.guest_keyboard
         )
         await callback.answer()
     else:
@@ -147,8 +150,7 @@ async def get_event_program(callback):
 
 # Назад в меню
 @router.callback_query(F.data == "back_to_menu")
-async def back_to_menu(callback):
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
+async def back_to_menu(callback, user):
     if user.role == 'guest':
         await callback.message.edit_text(
             'Главное меню ',
@@ -164,28 +166,51 @@ async def back_to_menu(callback):
 
 # Назад к программе
 @router.callback_query(F.data == "back_to_program")
-async def back_to_program(callback):
-    _, talks = await get_program()
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
+async def back_to_program(callback, user):
+    program = await get_program_snapshot()
+    if not program:
+        await callback.message.edit_text(
+            "Программа отсутствует",
+            reply_markup=back_keyboard
+        )
+        await callback.answer()
+        return
     if user.role == 'guest':
         await callback.message.edit_text(
             "Выберите доклад:",
-            reply_markup=get_program_inline_keyboard(talks)
+            reply_markup=program.page.guest_keyboard
         )
     if user.role == 'speaker':
         await callback.message.edit_text(
             "Выберите доклад:",
-            reply_markup=get_program_keyboard_for_speaker(talks)
+            reply_markup=program.page.speaker_keyboard
         )
     await callback.answer()
 
 
+# Листание программы: program_<event_id>_<n|p>_<id крайнего доклада>
+@router.callback_query(F.data.startswith("program_"))
+async def program_page(callback, user):
+    _, event_id, direction, cursor = callback.data.split("_")
+    page = await get_program_page_snapshot(
+        int(event_id), int(cursor), direction == "p"
+    )
+    if user and user.role == 'speaker':
+        markup = page.speaker_keyboard
+    else:
+        markup = page.guest_keyboard
+    try:
+        await callback.message.edit_reply_markup(reply_markup=markup)
+    except TelegramBadRequest:
+        pass
+    await callback.answer()
+
+
 # Список докладов
 @router.callback_query(F.data.startswith("talk_"))
-async def talk_details(callback, state):
+async def talk_details(callback, state, user):
     talk_id = int(callback.data.split("_")[1])
     talk = await get_talk(talk_id)
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
     
     if not talk:
         await callback.answer("Доклад не найден")
@@ -220,13 +245,9 @@ async def ask_question(callback, state):
     talk_id = int(callback.data.split("_")[2])
 
     now = timezone.now()
-    talk = await sync_to_async(Talk.objects.filter(
-        pk=talk_id,
-        actual_start_time__lte=now,
-        actual_end_time__isnull=True
-    ).first)()
+    schedule = await get_schedule()
 
-    if not talk:
+    if not schedule.accepting_questions(talk_id, now):
         await callback.message.edit_text(
             "Этот доклад не активен в данный момент. Вы можете вернуться назад",
             reply_markup=back_keyboard,
@@ -245,31 +266,96 @@ async def ask_question(callback, state):
     await callback.answer()
 
 
+question_notifier = QuestionNotifier(
+    interval=settings.QUESTION_DIGEST_INTERVAL
+)
+question_clusters = ClusterRegistry()
+process_lock = ProcessLock()
+question_votes = VoteAggregator(
+    batch_size=settings.VOTE_BATCH_SIZE,
+    flush_interval=settings.VOTE_FLUSH_INTERVAL,
+    top_size=settings.QUESTION_TOP_SIZE
+)
+
+
+async def forget_finished_talks(interval):
+    # Состояние докладов в памяти нужно, пока доклад принимает вопросы.
+    # Доклад могут завершить и из админки, поэтому сверяемся с расписанием
+    while True:
+        await asyncio.sleep(interval)
+        schedule = await get_schedule()
+        now = timezone.now()
+        for talk_id in list(question_clusters.talks):
+            if not schedule.accepting_questions(talk_id, now):
+                question_clusters.discard(talk_id)
+        for talk_id in list(question_votes.talks):
+            if not schedule.accepting_questions(talk_id, now):
+                question_votes.discard(talk_id)
+
+
+async def on_questions_saved(questions):
+    question_votes.add_questions(questions)
+    # Кластеризация — чистый CPU, считаем её вне event loop
+    await asyncio.to_thread(question_clusters.add, questions)
+    await question_notifier.notify(questions)
+
+
+# Вопросы пишутся в БД пачками, гость получает ответ сразу,
+# а спикер — дайджест новых вопросов после записи
+question_buffer = WriteBehindBuffer(
+    Question,
+    batch_size=settings.QUESTION_BATCH_SIZE,
+    flush_interval=settings.QUESTION_FLUSH_INTERVAL,
+    on_flush=on_questions_saved,
+    max_size=settings.QUESTION_QUEUE_SIZE
+)
+
+
 @router.message(QuestionStates.waiting_for_question)
-async def wait_question(message, state):
+async def wait_question(message, state, user):
     data = await state.get_data()
     talk_id = data.get('talk_id')
 
+    if not message.text:
+        await message.answer(
+            "Отправьте вопрос текстом.",
+            reply_markup=back_keyboard,
+            parse_mode=None
+        )
+        return
+    if len(message.text) > Question._meta.get_field('text').max_length:
+        await message.answer(
+            "Вопрос слишком длинный, сократите его до 250 символов.",
+            reply_markup=back_keyboard,
+            parse_mode=None
+        )
+        return
+
     try:
-        talk, user, question = await create_question(
-            text=message.text,
-            talk_id=talk_id,
-            name=message.from_user.full_name, 
-            telegram_id=message.from_user.id
+        if not user:
+            await message.answer(
+                "Вы не зарегистрированы. Пожалуйста, зарегистрируйтесь.",
+                reply_markup=start_keyboard,
+                parse_mode=None
             )
+            return
 
-        if not talk:
+        schedule = await get_schedule()
+        if not schedule.accepting_questions(talk_id, timezone.now()):
             await message.answer(
                 "Доклад уже завершился, вопросы больше не принимаются.",
                 parse_mode=None
             )
-            await state.clear()
             return
 
+        talk = schedule.talks[talk_id]
+        await question_buffer.add(
+            Question(talk_id=talk_id, guest=user, text=message.text)
+        )
         await message.answer(
             f"✅ Ваш вопрос отправлен\n\n"
             f"Доклад: {talk.title}\n"
-            f"Вопрос: {question.text}\n"
+            f"Вопрос: {message.text}\n"
             f"От: {user.name}\n",
             parse_mode=None,
             reply_markup=back_keyboard
@@ -284,47 +370,33 @@ async def wait_question(message, state):
         await state.clear()
 
 
-_BOT = None
-
-
-async def send_mailing(mailing):
-    if _BOT:
-        bot = _BOT
-    else:
-        bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-
-    users = await sync_to_async(lambda: list(mailing.users.all()))()
-    for user in users:
-        await asyncio.sleep(1)
-        try:
-            await bot.send_message(user.telegram_id, mailing.text)
-            await sync_to_async(MailingReport.objects.create)(user=user, mailing=mailing, status="Success")
-        except TelegramBadRequest as err:
-            await sync_to_async(MailingReport.objects.create)(user=user, mailing=mailing, status="Fail")
-            print(err)
+# Рассылку отправляет отдельный воркер (manage.py runmailer),
+# сохранение в админке не ждёт
+@receiver(m2m_changed, sender=Mailing.users.through)
+def commit_mailing(sender, instance, action, **kwargs):
+    if action == "post_add" and instance.segment == 'manual':
+        enqueue_mailing(instance)
+        print('Рассылка поставлена в очередь')
 
 
-@receiver(m2m_changed, sender=Mailing.users.through)
-async def commit_mailing(sender, instance, action, **kwargs):
-    if action == "post_add":
-        await send_mailing(instance)
-        print('Рассылка отправлена')
+# Рассылки по сегменту не ждут выбора получателей
+@receiver(post_save, sender=Mailing)
+def commit_segment_mailing(sender, instance, created, **kwargs):
+    if created and instance.segment != 'manual':
+        enqueue_mailing(instance)
+        print('Рассылка поставлена в очередь')
 
 
 @router.callback_query(F.data == "start_talk")
-async def handle_start_talk(callback):
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
+async def handle_start_talk(callback, user):
     if not user or user.role != 'speaker':
         await callback.message.edit_text("Вы не зарегистрированы как спикер.")
         await callback.answer()
         return
 
     now = timezone.now()
-    talk = await sync_to_async(Talk.objects.filter(
-        speaker=user,
-        start_time__lte=now,
-        end_time__gte=now
-    ).first)()
+    schedule = await get_schedule()
+    talk = schedule.speaker_talk(user.pk, now)
 
     if not talk:
         await callback.message.edit_text(
@@ -344,19 +416,15 @@ async def handle_start_talk(callback):
 
 
 @router.callback_query(F.data == "end_talk")
-async def handle_end_talk(callback):
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
+async def handle_end_talk(callback, user):
     if not user or user.role != 'speaker':
         await callback.message.edit_text("Вы не зарегистрированы как спикер.")
         await callback.answer()
         return
 
     now = timezone.now()
-    talk = await sync_to_async(Talk.objects.filter(
-        speaker=user,
-        actual_start_time__isnull=False,
-        actual_end_time__isnull=True
-    ).first)()
+    schedule = await get_schedule()
+    talk = schedule.speaker_live_talk(user.pk)
 
     if not talk:
         await callback.message.edit_text("У вас нет активных докладов.")
@@ -364,6 +432,8 @@ async def handle_end_talk(callback):
         return
 
     await end_talk(talk.id)
+    question_clusters.discard(talk.id)
+    question_votes.discard(talk.id)
     await callback.message.edit_text(
         f"Вы завершили выступление: {talk.title}\n"
         f"Время окончания: {timezone.localtime(now).strftime('%H:%M')}",
@@ -378,7 +448,8 @@ async def handle_end_talk(callback):
 
 @router.message(F.text == "/current_speakers")
 async def current_speakers_command(message):
-    talks = await get_current_talks()
+    schedule = await get_schedule()
+    talks = schedule.current_talks(timezone.now())
     if not talks:
         await message.answer("Сейчас нет активных докладов.")
         return
@@ -393,31 +464,251 @@ async def current_speakers_command(message):
 
 
 @router.callback_query(F.data == "speaker_questions")
-async def show_speaker_questions(callback):
-    user = await get_user(callback.from_user.id, callback.from_user.full_name)
-
+async def show_speaker_questions(callback, state, user):
     if not user or user.role != 'speaker':
         await callback.message.edit_text("Вы не зарегистрированы как спикер.")
         await callback.answer()
         return
 
-    questions = await get_speaker_questions(user.id)
-    
-    if not questions:
+    schedule = await get_schedule()
+    talk = schedule.speaker_talk(user.pk, timezone.now())
+    if not talk:
         await callback.message.edit_text("Пока нет ни одного вопроса к вашим докладам.")
         await callback.answer()
         return
 
-    text = "Вопросы к вашим докладам:\n\n"
+    # Курсор «последний просмотренный вопрос» хранится в данных FSM спикера
+    data = await state.get_data()
+    cursor = data.get('questions_cursor')
+    if not cursor or cursor['talk_id'] != talk.pk:
+        cursor = {'talk_id': talk.pk, 'created_at': None, 'id': 0}
+    created_at = cursor['created_at']
+    if created_at:
+        created_at = datetime.fromisoformat(created_at)
+    questions = await get_new_questions(
+        talk.pk,
+        created_at,
+        cursor['id'],
+        limit=settings.SPEAKER_QUESTIONS_PAGE_SIZE
+    )
+
+    if not questions:
+        await callback.message.edit_text(
+            "Новых вопросов нет.",
+            reply_markup=start_talk_keyboard
+        )
+        await callback.answer()
+        return
+
+    header = f"Новые вопросы к докладу «{escape(talk.title)}»:\n\n"
+    entries = [
+        f"<b>Гость:</b> {escape(q.guest.name or 'Без имени')}\n"
+        f"<b>Вопрос:</b> {escape(q.text)}\n"
+        f"{timezone.localtime(q.created_at).strftime('%d.%m %H:%M')}\n\n"
+        for q in questions
+    ]
+    # После экранирования страница может не влезть в одно сообщение:
+    # не вошедшие вопросы покажем при следующем нажатии
+    fitted = max(1, count_fitting(entries, MESSAGE_LIMIT - len(header)))
+    text = header + ''.join(entries[:fitted])
+
+    last = questions[fitted - 1]
+    cursor.update(created_at=last.created_at.isoformat(), id=last.pk)
+    await callback.message.edit_text(text, reply_markup=start_talk_keyboard)
+    # Курсор сдвигаем, только когда спикер увидел вопросы
+    await state.update_data(questions_cursor=cursor)
+    await callback.answer()
+
+
+async def show_question_page(
+    callback, user, talk_id, cursor=None, backward=False
+):
+    schedule = await get_schedule()
+    talk = schedule.talks.get(talk_id)
+    if not user or not talk or talk.speaker_id != user.pk:
+        await callback.answer("Вопросы доступны только спикеру доклада")
+        return
+
+    questions, has_prev, has_next = await get_question_page(
+        talk_id, cursor, backward, size=settings.SPEAKER_QUESTIONS_PAGE_SIZE
+    )
+    if not questions:
+        await callback.message.edit_text(
+            "Пока нет ни одного вопроса к вашему докладу.",
+            reply_markup=start_talk_keyboard
+        )
+        await callback.answer()
+        return
+
+    text = f"Вопросы к докладу «{escape(talk.title)}»:\n\n"
     for q in questions:
         text += (
-            f"<b>Доклад:</b> {q.talk.title}\n"
-            f"<b>Гость:</b> {q.guest.name or 'Без имени'}\n"
-            f"<b>Вопрос:</b> {q.text}\n"
+            f"<b>Гость:</b> {escape(q.guest.name or 'Без имени')}\n"
+            f"<b>Вопрос:</b> {escape(q.text)}\n"
             f"{timezone.localtime(q.created_at).strftime('%d.%m %H:%M')}\n\n"
         )
+    await callback.message.edit_text(
+        text,
+        reply_markup=get_questions_keyboard(
+            talk_id, questions, has_prev, has_next
+        )
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data == "speaker_all_questions")
+async def show_all_questions(callback, user):
+    if not user or user.role != 'speaker':
+        await callback.message.edit_text("Вы не зарегистрированы как спикер.")
+        await callback.answer()
+        return
+
+    schedule = await get_schedule()
+    talk = schedule.speaker_talk(user.pk, timezone.now())
+    if not talk:
+        await callback.message.edit_text("Пока нет ни одного вопроса к вашим докладам.")
+        await callback.answer()
+        return
+    await show_question_page(callback, user, talk.pk)
+
+
+# Листание вопросов: questions_<talk_id>_<n|p>_<id крайнего вопроса>
+@router.callback_query(F.data.startswith("questions_"))
+async def question_page(callback, user):
+    _, talk_id, direction, cursor = callback.data.split("_")
+    await show_question_page(
+        callback, user, int(talk_id), int(cursor), direction == "p"
+    )
+
+
+@router.callback_query(F.data == "speaker_clusters")
+async def show_question_clusters(callback, user):
+    if not user or user.role != 'speaker':
+        await callback.message.edit_text("Вы не зарегистрированы как спикер.")
+        await callback.answer()
+        return
+
+    schedule = await get_schedule()
+    talk = schedule.speaker_talk(user.pk, timezone.now())
+    if not talk:
+        await callback.message.edit_text("Пока нет ни одного вопроса к вашим докладам.")
+        await callback.answer()
+        return
+
+    # Первый запрос строит кластеры по всем вопросам доклада: тексты
+    # читаем async ORM, подписи считаем в отдельном потоке, чтобы
+    # не задерживать event loop и поток БД
+    clusters = await asyncio.to_thread(question_clusters.get, talk.pk)
+    if clusters is None:
+        question_clusters.expect(talk.pk)
+        questions = await load_question_texts(talk.pk)
+        clusters = await asyncio.to_thread(
+            question_clusters.build, talk.pk, questions
+        )
+    if not clusters:
+        await callback.message.edit_text(
+            "Пока нет ни одного вопроса к вашему докладу.",
+            reply_markup=start_talk_keyboard
+        )
+        await callback.answer()
+        return
+
+    text = "Похожие вопросы сгруппированы, сначала самые частые:\n\n"
+    for question, count in clusters[:settings.SPEAKER_CLUSTERS_LIMIT]:
+        text += f"<b>×{count}</b> {escape(question)}\n\n"
+    await callback.message.edit_text(text, reply_markup=start_talk_keyboard)
+    await callback.answer()
+
+
+async def get_top_questions(talk_id):
+    top = await question_votes.top(talk_id)
+    questions = await get_questions_by_ids(
+        [question_id for question_id, _ in top]
+    )
+    return [
+        (questions[question_id], votes)
+        for question_id, votes in top
+        if question_id in questions
+    ]
+
+
+# Вопросы текущего доклада по числу голосов, кнопка — проголосовать
+@router.callback_query(F.data.startswith("votes_"))
+async def show_votes(callback):
+    talk_id = int(callback.data.split("_")[1])
+    schedule = await get_schedule()
+    if not schedule.accepting_questions(talk_id, timezone.now()):
+        await callback.message.edit_text(
+            "Этот доклад не активен в данный момент. Вы можете вернуться назад",
+            reply_markup=back_keyboard,
+            parse_mode=None
+        )
+        await callback.answer()
+        return
 
-    await callback.message.edit_text(text[:4000], reply_markup=end_talk_keyboard)
+    questions = await get_top_questions(talk_id)
+    if not questions:
+        await callback.message.edit_text(
+            "Вопросов пока нет. Задайте первый!",
+            reply_markup=back_keyboard,
+            parse_mode=None
+        )
+        await callback.answer()
+        return
+
+    await callback.message.edit_text(
+        "Поддержите вопросы, которые хотите услышать:",
+        reply_markup=get_votes_keyboard(talk_id, questions),
+        parse_mode=None
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("vote_"))
+async def vote_question(callback, user):
+    _, talk_id, question_id = callback.data.split("_")
+    talk_id, question_id = int(talk_id), int(question_id)
+    schedule = await get_schedule()
+    if not user or not schedule.accepting_questions(talk_id, timezone.now()):
+        await callback.answer("Голосование по этому докладу закрыто")
+        return
+
+    if not await question_votes.vote(user.pk, talk_id, question_id):
+        await callback.answer("Вы уже голосовали за этот вопрос")
+        return
+
+    questions = await get_top_questions(talk_id)
+    try:
+        await callback.message.edit_reply_markup(
+            reply_markup=get_votes_keyboard(talk_id, questions)
+        )
+    except TelegramBadRequest:
+        pass
+    await callback.answer("Голос учтён")
+
+
+@router.callback_query(F.data == "speaker_top_questions")
+async def show_top_questions(callback, user):
+    if not user or user.role != 'speaker':
+        await callback.message.edit_text("Вы не зарегистрированы как спикер.")
+        await callback.answer()
+        return
+
+    schedule = await get_schedule()
+    talk = schedule.speaker_talk(user.pk, timezone.now())
+    questions = await get_top_questions(talk.pk) if talk else []
+    if not questions:
+        await callback.message.edit_text(
+            "Пока нет ни одного вопроса к вашему докладу.",
+            reply_markup=start_talk_keyboard
+        )
+        await callback.answer()
+        return
+
+    text = "Самые популярные вопросы:\n\n"
+    for question, votes in questions:
+        text += f"<b>👍 {votes}</b> {escape(question.text)}\n\n"
+    await callback.message.edit_text(text, reply_markup=start_talk_keyboard)
     await callback.answer()
 
 
@@ -458,9 +749,122 @@ async def successful_payment(message: Message):
     )
 
 
-async def main():
+def create_bot():
     bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
+    bot.session.middleware(TelegramMetricsMiddleware())
+    return bot
+
+
+def create_dispatcher():
+    storage = DjangoStorage(
+        state_ttl=settings.FSM_STATE_TTL,
+        cache_size=settings.FSM_CACHE_SIZE
+    )
+    dp = OrderedDispatcher(
+        storage=storage,
+        concurrency=settings.UPDATE_CONCURRENCY,
+        max_backlog=settings.UPDATE_BACKLOG,
+        chat_backlog=settings.UPDATE_CHAT_BACKLOG,
+        shed_timeout=settings.UPDATE_SHED_TIMEOUT
+    )
+    if settings.UPDATE_RECORD_PATH:
+        recorder = UpdateRecorder(
+            settings.UPDATE_RECORD_PATH, settings.SECRET_KEY
+        )
+        dp.update.outer_middleware(recorder)
+        dp.shutdown.register(recorder.close)
+    dp.update.outer_middleware(UserMiddleware())
+    metrics = MetricsMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+        observer.middleware(metrics)
     dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+# Общие для polling и webhook запуск и остановка фоновых задач
+async def on_startup(bot, dispatcher):
+    # Второй процесс бота над той же БД не стартует, см. ProcessLock
+    process_lock.acquire()
+    question_notifier.bot = bot
+    question_buffer.start()
+    question_votes.start()
+    dispatcher['storage_gc'] = asyncio.create_task(
+        dispatcher.storage.collect_garbage()
+    )
+    dispatcher['db_maintenance'] = asyncio.create_task(
+        maintain_connections(settings.DB_MAINTENANCE_INTERVAL)
+    )
+    dispatcher['talk_state_gc'] = asyncio.create_task(
+        forget_finished_talks(settings.TALK_STATE_GC_INTERVAL)
+    )
+
+
+async def on_shutdown(dispatcher):
+    await dispatcher.drain()
+    dispatcher['storage_gc'].cancel()
+    dispatcher['db_maintenance'].cancel()
+    dispatcher['talk_state_gc'].cancel()
+    # Вопросы, принятые до остановки, дописываем в БД. Каждый шаг
+    # выполняется, даже если предыдущий упал: иначе сбой записи вопросов
+    # оставил бы без записи голоса и незакрытым писателя
+    for close in (
+        question_buffer.close,
+        question_votes.close,
+        question_notifier.close,
+        db_writer.close
+    ):
+        try:
+            await close()
+        except Exception as err:
+            print(f'Ошибка при остановке бота: {err!r}')
+    # БД так и не ответила: гостям уже сказали, что вопрос отправлен,
+    # поэтому сохраняем его хотя бы в лог, откуда его можно восстановить
+    for question in question_buffer.items:
+        print('Вопрос не записан в БД: ' + json.dumps({
+            'talk_id': question.talk_id,
+            'guest_id': question.guest_id,
+            'text': question.text
+        }, ensure_ascii=False))
+    process_lock.release()
+
+
+async def set_webhook():
+    bot = create_bot()
+    dp = create_dispatcher()
+    try:
+        await bot.set_webhook(
+            settings.WEBHOOK_URL,
+            secret_token=settings.WEBHOOK_SECRET,
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True
+        )
+    finally:
+        await bot.session.close()
+
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    metrics_server = None
+    if settings.METRICS_PORT:
+        metrics_server = await metrics.serve(
+            settings.METRICS_HOST,
+            settings.METRICS_PORT,
+            settings.METRICS_TOKEN
+        )
+    try:
+        # Апдейты по одному уходят в очереди чатов: параллелизм и порядок
+        # обеспечивает OrderedDispatcher, а ожидание места в очереди
+        # тормозит polling
+        await dp.start_polling(
+            bot,
+            handle_as_tasks=False,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+    finally:
+        if metrics_server:
+            await metrics_server.cleanup()
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+
+class TokenBucket:
+    # Ведро токенов: не больше rate отправок в секунду, всплеск до capacity
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        # После flood control Telegram ведро пустое до конца паузы
+        self.tokens = 0
+        self.updated_at = max(self.updated_at, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.updated_at:
+                    await asyncio.sleep(self.updated_at - now)
+                    continue
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Broadcast:
+    # Параллельная рассылка с общим лимитом скорости и ограниченным числом
+    # одновременных запросов к Telegram
+    def __init__(
+        self, bot, rate=30, concurrency=30, max_retries=3, report_every=10
+    ):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.report_every = report_every
+        self.sent = 0
+        self.failed = 0
+        self.started_at = None
+
+    @property
+    def throughput(self):
+        if not self.started_at:
+            return 0
+        elapsed = time.monotonic() - self.started_at
+        return (self.sent + self.failed) / elapsed if elapsed else 0
+
+    def report(self):
+        print(
+            f"Рассылка: отправлено {self.sent}, ошибок {self.failed}, "
+            f"{self.throughput:.1f} сообщ/с"
+        )
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            self.report()
+
+    async def _deliver(self, user, text, on_result):
+        ok = False
+        for _ in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(user.telegram_id, text)
+                ok = True
+                break
+            except TelegramRetryAfter as err:
+                print(err)
+                self.bucket.pause(err.retry_after)
+            except TelegramAPIError as err:
+                print(err)
+                break
+
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if on_result:
+            await on_result(user, ok)
+
+    async def send(self, users, text, on_result=None):
+        self.started_at = time.monotonic()
+        reporter = asyncio.create_task(self._report_loop())
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        errors = []
+
+        def done(task):
+            tasks.discard(task)
+            slots.release()
+            if not task.cancelled() and task.exception():
+                errors.append(task.exception())
+
+        try:
+            for user in users:
+                await slots.acquire()
+                if errors:
+                    break
+                task = asyncio.create_task(
+                    self._deliver(user, text, on_result)
+                )
+                tasks.add(task)
+                task.add_done_callback(done)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if errors:
+                raise errors[0]
+        finally:
+            reporter.cancel()
+            self.report()
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+from django.db import transaction
+
+from .writer import db_writer
+
+
+# Сколько раз при остановке пытаемся дописать хвост, прежде чем сдаться
+CLOSE_ATTEMPTS = 3
+# Потолок паузы между повторами, пока БД не отвечает
+MAX_RETRY_DELAY = 60
+
+
+class WriteBehindBuffer:
+    # Копит несохранённые объекты модели и пишет их одной транзакцией через
+    # bulk_create: когда набралось batch_size штук или прошло
+    # flush_interval секунд.
+    # При max_size в очереди добавление ждёт записи — так буфер ограничен
+    def __init__(
+        self,
+        model,
+        batch_size=500,
+        flush_interval=2.0,
+        on_flush=None,
+        max_size=None
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.max_size = max_size
+        self.items = []
+        self.oldest_at = None
+        self._lock = asyncio.Lock()
+        self._closed = asyncio.Event()
+        self._task = None
+
+    @property
+    def lag(self):
+        # Сколько секунд самый старый объект ждёт записи в БД
+        if not self.items:
+            return 0
+        return time.monotonic() - self.oldest_at
+
+    async def add(self, obj):
+        while self.max_size and len(self.items) >= self.max_size:
+            if not await self._try_flush():
+                await asyncio.sleep(self.flush_interval)
+        if not self.items:
+            self.oldest_at = time.monotonic()
+        self.items.append(obj)
+        if len(self.items) >= self.batch_size:
+            # Объект уже в буфере: если запись не удалась, допишет фоновый цикл
+            await self._try_flush()
+
+    def _write(self, items):
+        with transaction.atomic():
+            self.model.objects.bulk_create(items, batch_size=self.batch_size)
+
+    async def flush(self):
+        async with self._lock:
+            lag = self.lag
+            oldest_at = self.oldest_at
+            items, self.items = self.items, []
+            if not items:
+                return
+            try:
+                await db_writer.write(self._write, items)
+            except Exception:
+                # Пачка возвращается в начало буфера и уйдёт следующей записью
+                self.items[:0] = items
+                self.oldest_at = oldest_at
+                raise
+            if lag > 2 * self.flush_interval:
+                print(
+                    f'{self.model.__name__}: записано {len(items)}, '
+                    f'отставание {lag:.1f} с'
+                )
+        # Обработчик зовём уже без блокировки: пока он ходит в БД, следующая
+        # пачка пишется, а сам он может добавлять в буфер и сбрасывать его
+        if self.on_flush:
+            try:
+                await self.on_flush(items)
+            except Exception as err:
+                # Пачка уже в БД: сбой обработчика не повод писать её снова
+                print(f'{self.model.__name__}: ошибка on_flush: {err}')
+
+    async def _try_flush(self):
+        try:
+            await self.flush()
+        except Exception as err:
+            print(
+                f'{self.model.__name__}: не удалось записать '
+                f'{len(self.items)}: {err}'
+            )
+            return False
+        return True
+
+    async def _flush_loop(self):
+        delay = self.flush_interval
+        while not self._closed.is_set():
+            try:
+                await asyncio.wait_for(self._closed.wait(), delay)
+            except asyncio.TimeoutError:
+                # Пока БД не отвечает, повторяем реже, но не останавливаемся
+                if await self._try_flush():
+                    delay = self.flush_interval
+                else:
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def start(self):
+        if not self._task:
+            self._closed.clear()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        # Фоновую запись не прерываем на середине: дожидаемся её
+        # и дописываем хвост
+        self._closed.set()
+        if self._task:
+            try:
+                await self._task
+            except Exception as err:
+                print(f'{self.model.__name__}: фоновая запись упала: {err}')
+            finally:
+                self._task = None
+        for attempt in range(CLOSE_ATTEMPTS):
+            if await self._try_flush():
+                return
+            if attempt < CLOSE_ATTEMPTS - 1:
+                await asyncio.sleep(self.flush_interval)
+        raise RuntimeError(
+            f'{self.model.__name__}: не записано {len(self.items)}'
+        )
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
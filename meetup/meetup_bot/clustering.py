@@ -0,0 +1,176 @@
+from collections import defaultdict
+import random
+import re
+import threading
+import zlib
+
+
+MASK = (1 << 64) - 1
+
+
+def shingles(text, size=3):
+    text = re.sub(r'[^\w ]+', ' ', text.lower())
+    text = ' '.join(text.split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class QuestionClusters:
+    # Группы похожих вопросов одного доклада: MinHash-подписи по символьным
+    # шинглам и LSH-корзины по полосам подписи. Вопрос сравнивается только
+    # с кандидатами из своих корзин, группы склеиваются через union-find
+    def __init__(self, num_perm=63, bands=21, threshold=0.5, seed=1):
+        rng = random.Random(seed)
+        self.permutations = [
+            (rng.getrandbits(64) | 1, rng.getrandbits(64))
+            for _ in range(num_perm)
+        ]
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.signatures = {}
+        self.parent = {}
+        self.texts = {}
+
+    def signature(self, text):
+        hashes = [zlib.crc32(shingle.encode()) for shingle in shingles(text)]
+        # Multiply-shift хеширование: старшие 32 бита от (a * h + b) mod 2^64
+        return tuple(
+            min(((a * h + b) & MASK) >> 32 for h in hashes)
+            for a, b in self.permutations
+        )
+
+    def similarity(self, first, second):
+        return sum(x == y for x, y in zip(first, second)) / len(first)
+
+    def find(self, question_id):
+        root = question_id
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[question_id] != root:
+            parent = self.parent[question_id]
+            self.parent[question_id] = root
+            question_id = parent
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            # Представитель группы — самый ранний вопрос
+            self.parent[max(first, second)] = min(first, second)
+
+    def add(self, question_id, text):
+        if question_id in self.signatures:
+            return
+        signature = self.signature(text)
+        self.signatures[question_id] = signature
+        self.parent[question_id] = question_id
+        self.texts[question_id] = text
+        candidates = set()
+        for band, buckets in enumerate(self.buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows]
+            candidates.update(buckets[key])
+            buckets[key].append(question_id)
+        for candidate in candidates:
+            # Кандидаты из уже объединённой группы проверять незачем
+            if self.find(candidate) == self.find(question_id):
+                continue
+            similarity = self.similarity(
+                signature, self.signatures[candidate]
+            )
+            if similarity >= self.threshold:
+                self.union(question_id, candidate)
+
+    def clusters(self):
+        groups = defaultdict(int)
+        for question_id in self.parent:
+            groups[self.find(question_id)] += 1
+        return sorted(
+            ((self.texts[root], count) for root, count in groups.items()),
+            key=lambda cluster: -cluster[1]
+        )
+
+
+class ClusterRegistry:
+    # Кластеры по докладам. Строятся из вопросов доклада при первом запросе
+    # и дальше пополняются записанными вопросами. Сборка идёт без общей
+    # блокировки: вопросы, записанные во время сборки, встают в очередь
+    # доклада, а пополнение других докладов её не ждёт
+    def __init__(self):
+        self.talks = {}
+        self._locks = {}
+        self._pending = {}
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def get(self, talk_id):
+        # None — кластеры доклада ещё не построены, см. expect и build
+        with self._lock:
+            clusters = self.talks.get(talk_id)
+            lock = self._locks.get(talk_id)
+        if clusters is None:
+            return None
+        with lock:
+            return clusters.clusters()
+
+    def expect(self, talk_id):
+        # До загрузки вопросов из БД: записанные после неё не потеряются
+        with self._lock:
+            if talk_id not in self.talks:
+                self._pending.setdefault(talk_id, [])
+
+    def build(self, talk_id, questions):
+        # Подписи MinHash — чистый CPU: вызывать из потока, не из event loop
+        with self._lock:
+            building = self._building.setdefault(talk_id, threading.Lock())
+        # Второй запрос того же доклада дождётся первой сборки
+        with building:
+            try:
+                if self.get(talk_id) is None:
+                    self._build(talk_id, questions)
+            finally:
+                with self._lock:
+                    self._pending.pop(talk_id, None)
+                    self._building.pop(talk_id, None)
+        return self.get(talk_id)
+
+    def _build(self, talk_id, questions):
+        clusters = QuestionClusters()
+        for question_id, text in questions:
+            clusters.add(question_id, text)
+        while True:
+            with self._lock:
+                pending = self._pending.get(talk_id)
+                if not pending:
+                    # Публикуем под той же блокировкой, что и очередь:
+                    # следующий вопрос пойдёт уже в построенные кластеры
+                    self.talks[talk_id] = clusters
+                    self._locks[talk_id] = threading.Lock()
+                    self._pending.pop(talk_id, None)
+                    return
+                self._pending[talk_id] = []
+            # Повторы вопросов из БД QuestionClusters.add пропускает
+            for question_id, text in pending:
+                clusters.add(question_id, text)
+
+    def add(self, questions):
+        for question in questions:
+            with self._lock:
+                pending = self._pending.get(question.talk_id)
+                if pending is not None:
+                    pending.append((question.pk, question.text))
+                    continue
+                clusters = self.talks.get(question.talk_id)
+                lock = self._locks.get(question.talk_id)
+            # Ещё не построенный доклад подтянет вопрос из БД сам
+            if clusters is not None:
+                with lock:
+                    clusters.add(question.pk, question.text)
+
+    def discard(self, talk_id):
+        with self._lock:
+            self.talks.pop(talk_id, None)
+            self._locks.pop(talk_id, None)
+            self._pending.pop(talk_id, None)
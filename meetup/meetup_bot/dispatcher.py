@@ -0,0 +1,99 @@
+import asyncio
+from collections import defaultdict
+from functools import partial
+import time
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+
+
+class OrderedDispatcher(Dispatcher):
+    # Апдейты одного чата обрабатываются строго по очереди (FSM-сценарии
+    # зависят от порядка), разных чатов — параллельно, не больше concurrency
+    # одновременно. feed_update только ставит апдейт в очередь чата
+    def __init__(
+        self,
+        *,
+        concurrency=100,
+        max_backlog=10000,
+        chat_backlog=20,
+        shed_timeout=5,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.concurrency = asyncio.Semaphore(concurrency)
+        self.backlog = asyncio.Semaphore(max_backlog)
+        self.chat_backlog = chat_backlog
+        self.shed_timeout = shed_timeout
+        self.tails = {}
+        self.queued = defaultdict(int)
+        self.shed = 0
+        self._tasks = set()
+
+    def chat_key(self, update):
+        context = UserContextMiddleware.resolve_event_context(update)
+        if context.chat:
+            return context.chat.id
+        return context.user_id
+
+    def _shed(self, update, reason):
+        self.shed += 1
+        print(
+            f'Апдейт {update.update_id} отброшен: {reason} '
+            f'(всего отброшено {self.shed})'
+        )
+
+    @property
+    def pending(self):
+        # Принятые, но ещё не обработанные апдейты
+        return len(self._tasks)
+
+    async def feed_update(self, bot, update, **kwargs):
+        # Время прихода апдейта: до очереди, видно middleware как received_at
+        kwargs.setdefault('received_at', time.time())
+        key = self.chat_key(update)
+        # Один чат не должен занять всю очередь
+        if key is not None and self.queued[key] >= self.chat_backlog:
+            self._shed(update, f'очередь чата {key} переполнена')
+            return None
+        # Общая очередь полна: ждём место (при polling это притормаживает
+        # получение апдейтов), а если не дождались — сбрасываем нагрузку
+        try:
+            await asyncio.wait_for(self.backlog.acquire(), self.shed_timeout)
+        except asyncio.TimeoutError:
+            self._shed(update, 'общая очередь переполнена')
+            return None
+        previous = self.tails.get(key) if key is not None else None
+        task = asyncio.create_task(
+            self._process_in_order(previous, bot, update, kwargs)
+        )
+        self._tasks.add(task)
+        if key is not None:
+            self.tails[key] = task
+            self.queued[key] += 1
+        task.add_done_callback(partial(self._done, key))
+        return None
+
+    async def _process_in_order(self, previous, bot, update, kwargs):
+        if previous:
+            # Ошибка предыдущего апдейта не должна останавливать очередь чата
+            await asyncio.wait([previous])
+        async with self.concurrency:
+            return await super().feed_update(bot, update, **kwargs)
+
+    def _done(self, key, task):
+        self._tasks.discard(task)
+        self.backlog.release()
+        if key is not None:
+            self.queued[key] -= 1
+            if not self.queued[key]:
+                del self.queued[key]
+            if self.tails.get(key) is task:
+                del self.tails[key]
+        if not task.cancelled() and task.exception():
+            print(f'Ошибка обработки апдейта: {task.exception()!r}')
+
+    async def drain(self):
+        # Дожидаемся уже принятых апдейтов перед остановкой
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -27,7 +27,27 @@ start_speaker_keyboard = InlineKeyboardMarkup(
 
 start_talk_keyboard = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="Получить вопросы", callback_data="speaker_questions")]
+        [InlineKeyboardButton(
+            text="Получить вопросы",
+            callback_data="speaker_questions"
+        )],
+        [InlineKeyboardButton(
+            text="Все вопросы",
+            callback_data="speaker_all_questions"
+        )],
+        [InlineKeyboardButton(
+            text="Похожие вопросы",
+            callback_data="speaker_clusters"
+        )],
+        [InlineKeyboardButton(
+            text="Популярные вопросы",
+            callback_data="speaker_top_questions"
+        )],
+        # Закончить выступление можно с любого экрана спикера
+        [InlineKeyboardButton(
+            text="Закончить выступление",
+            callback_data="end_talk"
+        )]
     ]
 )
 
@@ -45,12 +65,48 @@ def get_talk_inline_keyboard(talk):
             text="✍ Задать вопрос",
             callback_data=f"ask_question_{talk.pk}"
         )],
+        [InlineKeyboardButton(
+            text="👍 Вопросы слушателей",
+            callback_data=f"votes_{talk.pk}"
+        )],
         [InlineKeyboardButton(text="Назад в меню", callback_data="back_to_menu")]
     ])
     return talk_keyboard
 
 
-def get_program_inline_keyboard(talks):
+def get_votes_keyboard(talk_id, questions):
+    votes_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            *[
+                [InlineKeyboardButton(
+                    text=f"👍 {votes} · {question.text[:40]}",
+                    callback_data=f"vote_{talk_id}_{question.pk}"
+                )]
+                for question, votes in questions
+            ],
+            [InlineKeyboardButton(text="Назад в меню", callback_data="back_to_menu")]
+        ]
+    )
+    return votes_keyboard
+
+
+def get_program_navigation(event_id, talks, has_prev, has_next):
+    # Курсор страницы — id крайнего доклада, его хватает для keyset-запроса
+    buttons = []
+    if talks and has_prev:
+        buttons.append(InlineKeyboardButton(
+            text="⬅ Раньше",
+            callback_data=f"program_{event_id}_p_{talks[0].pk}"
+        ))
+    if talks and has_next:
+        buttons.append(InlineKeyboardButton(
+            text="Позже ➡",
+            callback_data=f"program_{event_id}_n_{talks[-1].pk}"
+        ))
+    return [buttons] if buttons else []
+
+
+def get_program_inline_keyboard(talks, navigation=()):
     program_keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             *[
@@ -60,13 +116,14 @@ def get_program_inline_keyboard(talks):
                 )] 
                 for talk in talks
             ],
+            *navigation,
             [InlineKeyboardButton(text="Назад в меню", callback_data="back_to_menu")]
         ]
     )
     return program_keyboard
 
 
-def get_program_keyboard_for_speaker(talks):
+def get_program_keyboard_for_speaker(talks, navigation=()):
     program_keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
             *[
@@ -76,12 +133,41 @@ def get_program_keyboard_for_speaker(talks):
                 )] 
                 for talk in talks
             ],
+            *navigation,
             [InlineKeyboardButton(text="Назад в меню", callback_data="back_to_speaker_menu")]
         ]
     )
     return program_keyboard
 
 
+def get_questions_keyboard(talk_id, questions, has_prev, has_next):
+    navigation = []
+    if questions and has_prev:
+        navigation.append(InlineKeyboardButton(
+            text="⬅ Раньше",
+            callback_data=f"questions_{talk_id}_p_{questions[0].pk}"
+        ))
+    if questions and has_next:
+        navigation.append(InlineKeyboardButton(
+            text="Позже ➡",
+            callback_data=f"questions_{talk_id}_n_{questions[-1].pk}"
+        ))
+    questions_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            *([navigation] if navigation else []),
+            [InlineKeyboardButton(
+                text="Новые вопросы",
+                callback_data="speaker_questions"
+            )],
+            [InlineKeyboardButton(
+                text="Закончить выступление",
+                callback_data="end_talk"
+            )]
+        ]
+    )
+    return questions_keyboard
+
+
 back_keyboard = InlineKeyboardMarkup(
     inline_keyboard=[
         [InlineKeyboardButton(text="Назад в меню", callback_data="back_to_menu")]
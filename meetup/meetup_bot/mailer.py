@@ -0,0 +1,94 @@
+import asyncio
+import os
+import socket
+
+from django.conf import settings
+from aiogram import Bot
+from aiogram.enums.parse_mode import ParseMode
+from aiogram.client.default import DefaultBotProperties
+
+from .broadcast import Broadcast
+from .buffers import WriteBehindBuffer
+from .models import (
+    MailingReport,
+    lease_mailing_job,
+    advance_mailing_job,
+    finish_mailing_job,
+    get_mailing_chunk,
+    count_mailing_reports
+)
+from .writer import db_writer, maintain_connections
+
+
+async def send_mailing(bot, job):
+    mailing = job.mailing
+    broadcast = Broadcast(
+        bot,
+        rate=settings.MAILING_RATE_LIMIT,
+        concurrency=settings.MAILING_CONCURRENCY
+    )
+    reports = WriteBehindBuffer(
+        MailingReport,
+        batch_size=settings.MAILING_REPORT_BATCH_SIZE,
+        flush_interval=settings.MAILING_REPORT_FLUSH_INTERVAL,
+        on_flush=count_mailing_reports
+    )
+
+    async def save_report(user, ok):
+        status = "Success" if ok else "Fail"
+        await reports.add(
+            MailingReport(user=user, mailing=mailing, status=status)
+        )
+
+    # Отчёты дописываются в базу при выходе из блока, даже если рассылку
+    # прервали
+    async with reports:
+        while True:
+            users = await get_mailing_chunk(
+                mailing, job.cursor, settings.MAILING_CHUNK_SIZE
+            )
+            if not users:
+                return True
+            await broadcast.send(users, mailing.text, on_result=save_report)
+            # Курсор двигаем только после того, как отчёты по пачке записаны
+            await reports.flush()
+            advanced = await advance_mailing_job(
+                job, users[-1].pk, settings.MAILING_LEASE_SECONDS
+            )
+            if not advanced:
+                print(
+                    f'Задачу рассылки {job.pk} перехватил другой воркер '
+                    'или её перезапустили'
+                )
+                return False
+
+
+async def run_mailer(poll_interval=5):
+    bot = Bot(
+        token=settings.BOT_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    db_maintenance = asyncio.create_task(
+        maintain_connections(settings.DB_MAINTENANCE_INTERVAL)
+    )
+    try:
+        while True:
+            job = await lease_mailing_job(
+                worker, settings.MAILING_LEASE_SECONDS
+            )
+            if not job:
+                await asyncio.sleep(poll_interval)
+                continue
+            print(f'Рассылка {job.mailing.pk}: старт с курсора {job.cursor}')
+            try:
+                if await send_mailing(bot, job):
+                    await finish_mailing_job(job)
+                    print(f'Рассылка {job.mailing.pk} отправлена')
+            except Exception as err:
+                await finish_mailing_job(job, error=str(err))
+                print(f'Рассылка {job.mailing.pk} завершилась ошибкой: {err}')
+    finally:
+        db_maintenance.cancel()
+        await bot.session.close()
+        await db_writer.close()
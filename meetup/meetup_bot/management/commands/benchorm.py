@@ -0,0 +1,259 @@
+from datetime import timedelta
+import asyncio
+import gc
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connections, models
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from ...models import (
+    CustomUser,
+    Event,
+    Question,
+    QuestionVote,
+    Talk,
+    end_talk,
+    get_cached_user,
+    get_question_page,
+    get_talk,
+    question_page_queryset,
+    start_talk
+)
+from ...schedule import get_schedule
+from ...votes import VoteAggregator
+from ...writer import db_writer
+
+
+# Пути бота в том виде, в каком они были до перехода на async ORM:
+# каждый вызов — отдельный переход в поток и запрос в БД, лишние чтения
+# перед записью. Новые — те же функции, что вызывают хендлеры
+
+
+@sync_to_async
+def old_get_user(telegram_id, name):
+    try:
+        return CustomUser.objects.get(telegram_id=telegram_id, name=name)
+    except CustomUser.DoesNotExist:
+        return
+
+
+@sync_to_async
+def old_get_talk(talk_id):
+    return Talk.objects.select_related('speaker').get(pk=talk_id)
+
+
+@sync_to_async
+def old_start_talk(talk_id):
+    talk = Talk.objects.get(pk=talk_id)
+    talk.actual_start_time = timezone.now()
+    talk.actual_end_time = None
+    talk.save(update_fields=['actual_start_time', 'actual_end_time'])
+    return talk
+
+
+@sync_to_async
+def old_end_talk(talk_id):
+    talk = Talk.objects.get(pk=talk_id)
+    talk.actual_end_time = timezone.now()
+    talk.save(update_fields=['actual_end_time'])
+    speaker = talk.speaker
+    speaker.role = 'guest'
+    speaker.save()
+    return talk
+
+
+@sync_to_async
+def old_get_question_page(talk_id, size=10):
+    rows = list(question_page_queryset(talk_id)[:size + 1])
+    return rows[:size], False, len(rows) > size
+
+
+@sync_to_async
+def old_get_speaker_talk(speaker_id):
+    now = timezone.now()
+    return Talk.objects.select_related('speaker').filter(
+        speaker_id=speaker_id, start_time__lte=now, end_time__gte=now
+    ).first()
+
+
+@sync_to_async
+def old_vote(user_id, question_id):
+    _, created = QuestionVote.objects.get_or_create(
+        user_id=user_id, question_id=question_id
+    )
+    if created:
+        Question.objects.filter(pk=question_id).update(
+            votes_count=models.F('votes_count') + 1
+        )
+    return created
+
+
+async def new_speaker_talk(speaker_id):
+    schedule = await get_schedule()
+    return schedule.speaker_talk(speaker_id, timezone.now())
+
+
+def seed(users, questions):
+    now = timezone.now()
+    guests = CustomUser.objects.bulk_create(
+        CustomUser(telegram_id=i, name=f'Гость {i}', role='guest')
+        for i in range(1, users + 1)
+    )
+    speakers = CustomUser.objects.bulk_create(
+        CustomUser(telegram_id=-i, name=f'Спикер {i}', role='speaker')
+        for i in range(1, 11)
+    )
+    event = Event.objects.create(
+        title='Бенчмарк', start_date=now, end_date=now + timedelta(hours=8)
+    )
+    talks = Talk.objects.bulk_create(
+        Talk(
+            speaker=speaker,
+            title=f'Доклад {speaker.name}',
+            start_time=now - timedelta(minutes=10),
+            end_time=now + timedelta(hours=1),
+            event=event
+        )
+        for speaker in speakers
+    )
+    questions = Question.objects.bulk_create(
+        Question(
+            talk=talks[i % len(talks)],
+            guest=guests[i % len(guests)],
+            text=f'Вопрос {i}'
+        )
+        for i in range(questions)
+    )
+    return guests, speakers, talks, questions
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку обращений бота к БД до и после перехода '
+        'на async ORM и кэши в памяти под конкурентной нагрузкой'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=2000)
+
+    def handle(self, *args, **kwargs):
+        # Отдельная тестовая БД: бенчмарк пишет в таблицы докладов
+        # и пользователей
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            data = seed(kwargs['users'], kwargs['questions'])
+            asyncio.run(self.run(
+                *data, kwargs['requests'], kwargs['concurrency']
+            ))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    async def run(
+        self, guests, speakers, talks, questions, requests, concurrency
+    ):
+        def user(i):
+            guest = guests[i % len(guests)]
+            return guest.telegram_id, guest.name
+
+        def talk(i):
+            return talks[i % len(talks)].pk
+
+        def speaker(i):
+            return speakers[i % len(speakers)].pk
+
+        async def old_talk_cycle(i):
+            await old_start_talk(talk(i))
+            await old_end_talk(talk(i))
+
+        async def new_talk_cycle(i):
+            await start_talk(talk(i))
+            await end_talk(talk(i))
+
+        def vote(i):
+            # Пары «гость — вопрос» не повторяются, пока i меньше
+            # users * questions
+            guest = guests[i % len(guests)]
+            question = questions[i // len(guests) % len(questions)]
+            return guest.pk, question.talk_id, question.pk
+
+        votes = VoteAggregator()
+
+        async def old_vote_call(i):
+            user_id, _, question_id = vote(i)
+            await old_vote(user_id, question_id)
+
+        async def new_vote_call(i):
+            await votes.vote(*vote(requests + i))
+
+        scenarios = [
+            (
+                'пользователь',
+                lambda i: old_get_user(*user(i)),
+                lambda i: get_cached_user(*user(i))
+            ),
+            (
+                'доклад со спикером',
+                lambda i: old_get_talk(talk(i)),
+                lambda i: get_talk(talk(i))
+            ),
+            ('начало и конец доклада', old_talk_cycle, new_talk_cycle),
+            (
+                'страница вопросов',
+                lambda i: old_get_question_page(talk(i)),
+                lambda i: get_question_page(talk(i))
+            ),
+            (
+                'доклад спикера сейчас',
+                lambda i: old_get_speaker_talk(speaker(i)),
+                lambda i: new_speaker_talk(speaker(i))
+            ),
+            ('голос за вопрос', old_vote_call, new_vote_call),
+        ]
+        votes.start()
+        try:
+            for name, old, new in scenarios:
+                self.stdout.write(name)
+                for label, call in (('до', old), ('после', new)):
+                    latencies, elapsed = await self.measure(
+                        call, requests, concurrency
+                    )
+                    self.report(label, latencies, elapsed)
+        finally:
+            # Голоса из буфера дописываются до остановки писателя
+            await votes.close()
+            await db_writer.close()
+            # Соединения потока sync_to_async держат WAL-файлы тестовой БД
+            await sync_to_async(connections.close_all)()
+
+    async def measure(self, call, requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(i):
+            async with semaphore:
+                started = time.perf_counter()
+                await call(i)
+                latencies.append(time.perf_counter() - started)
+
+        # Мусор от предыдущего прогона не должен собираться посреди замера
+        gc.collect()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return latencies, time.perf_counter() - started
+
+    def report(self, label, latencies, elapsed):
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'  {label:>5}: {len(latencies) / elapsed:8.0f} запр/с'
+            f'  среднее {statistics.mean(latencies) * 1000:7.2f} мс'
+            f'  p50 {percentiles[49] * 1000:7.2f} мс'
+            f'  p95 {percentiles[94] * 1000:7.2f} мс'
+            f'  p99 {percentiles[98] * 1000:7.2f} мс'
+        )
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import (
+    CustomUser,
+    Mailing,
+    Talk,
+    program_page_queryset,
+    question_page_queryset
+)
+
+
+def recipients_batch(segment):
+    # Очередная пачка воркера рассылки, см. get_mailing_chunk
+    mailing = Mailing(pk=0, segment=segment, event_id=0, talk_id=0)
+    return mailing.get_recipients().filter(
+        pk__gt=0
+    ).exclude(mailingreport__mailing=mailing).order_by('pk')[:500]
+
+
+def hot_queries():
+    now = timezone.now()
+    # Те же запросы, что выполняют хендлеры бота и воркер рассылки
+    return {
+        'программа: первая страница': program_page_queryset(0),
+        'программа: следующая страница': program_page_queryset(0, cursor=1),
+        'программа: предыдущая страница': program_page_queryset(
+            0, cursor=1, backward=True
+        ),
+        'расписание дня': Talk.objects.select_related('speaker').filter(
+            end_time__gte=now, start_time__lt=now
+        ),
+        'идущие доклады': Talk.objects.select_related('speaker').filter(
+            actual_start_time__isnull=False, actual_end_time__isnull=True
+        ),
+        'доклад спикера сейчас': Talk.objects.filter(
+            speaker_id=0, start_time__lte=now, end_time__gte=now
+        ),
+        'вопросы: первая страница': question_page_queryset(0),
+        'вопросы: следующая страница': question_page_queryset(0, cursor=1),
+        'пользователь по telegram_id': CustomUser.objects.filter(
+            telegram_id=0
+        ),
+        'получатели: гости': recipients_batch('guests'),
+        'получатели: участники мероприятия': recipients_batch('event'),
+        'получатели: авторы вопросов к докладу': recipients_batch(
+            'talk_askers'
+        ),
+        'получатели: выбранные вручную': recipients_batch('manual'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Проверяет через EXPLAIN, что горячие запросы идут по индексам'
+
+    def handle(self, *args, **kwargs):
+        failed = []
+        for name, queryset in hot_queries().items():
+            plan = queryset.explain()
+            # SQLite пишет «SCAN <таблица>» для полного прохода без индекса
+            scans = [
+                line for line in plan.splitlines()
+                if ' SCAN ' in f' {line} ' and 'USING' not in line
+            ]
+            if scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'✗ {name}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'✓ {name}'))
+            self.stdout.write(plan)
+        if failed:
+            raise CommandError(f"Полный проход таблицы: {', '.join(failed)}")
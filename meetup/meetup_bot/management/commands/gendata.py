@@ -0,0 +1,287 @@
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from ...models import (
+    CustomUser,
+    Event,
+    Mailing,
+    Question,
+    QuestionVote,
+    Talk
+)
+
+
+# Сгенерированные telegram_id выше настоящих, чтобы не пересечься
+# с живыми пользователями
+TELEGRAM_ID_BASE = 10 ** 12
+# День последнего мероприятия по умолчанию: данные не зависят от даты прогона
+DEFAULT_DATE = '2025-06-02'
+# Момент «сейчас» внутри этого дня: часть докладов прошла, один идёт,
+# часть впереди
+NOW_HOUR = 14
+
+FIRST_NAMES = [
+    'Анна', 'Иван', 'Мария', 'Дмитрий', 'Елена', 'Сергей', 'Ольга',
+    'Алексей', 'Наталья', 'Андрей', 'Татьяна', 'Михаил', 'Юлия', 'Павел',
+    'Ксения', 'Никита',
+]
+TOPICS = [
+    'асинхронный Python', 'Django ORM', 'индексы в SQLite', 'Telegram-боты',
+    'нагрузочное тестирование', 'кеширование', 'очереди задач',
+    'мониторинг', 'типизация', 'миграции схемы', 'профилирование',
+]
+QUESTIONS = [
+    'Как {topic} ведёт себя под нагрузкой?',
+    'С чего начать, если {topic} в проекте ещё нет?',
+    'Какие грабли вы собрали, внедряя {topic}?',
+    'Чем {topic} лучше того, что было раньше?',
+    'Где почитать про {topic} подробнее?',
+    'Как тестировать {topic} без продакшена?',
+]
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def explicit_created_at(model):
+    # auto_now_add перезаписывает created_at и в bulk_create, а вопросам
+    # нужно время внутри доклада, иначе пагинация по created_at вырождается.
+    # Голосам — время после вопроса, чтобы прогоны не зависели от часов
+    field = model._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Заполняет БД синтетическим крупным мероприятием для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10)
+        parser.add_argument('--talks-per-event', type=int, default=30)
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100000,
+            help='Всего пользователей, включая спикеров'
+        )
+        parser.add_argument('--questions-per-talk', type=int, default=3000)
+        parser.add_argument(
+            '--mailing-size',
+            type=int,
+            default=50000,
+            help='Получателей ручной рассылки'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Одинаковый seed даёт одинаковые данные'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--date',
+            type=date.fromisoformat,
+            default=DEFAULT_DATE,
+            help=(
+                'День последнего мероприятия, ГГГГ-ММ-ДД; '
+                'для живого бота — сегодня'
+            )
+        )
+
+    def handle(self, *args, **kwargs):
+        talks_count = kwargs['events'] * kwargs['talks_per_event']
+        if kwargs['users'] <= talks_count:
+            raise CommandError(
+                'Пользователей должно быть больше, чем докладов: '
+                'у каждого доклада свой спикер'
+            )
+        if kwargs['mailing_size'] > kwargs['users']:
+            raise CommandError(
+                'Получателей рассылки больше, чем пользователей'
+            )
+        synthetic = CustomUser.objects.filter(
+            telegram_id__gte=TELEGRAM_ID_BASE
+        )
+        if synthetic.exists():
+            raise CommandError(
+                'Синтетические данные уже есть, очистите БД: manage.py flush'
+            )
+        self.rng = random.Random(kwargs['seed'])
+        self.batch_size = kwargs['batch_size']
+        # Одинаковые seed и --date дают одинаковые данные вплоть до времени
+        day = kwargs['date']
+        self.now = timezone.make_aware(
+            datetime(day.year, day.month, day.day, NOW_HOUR)
+        )
+        started = time.perf_counter()
+        with transaction.atomic(using='default'):
+            speakers, guests = self.step(
+                'пользователи', self.create_users, kwargs['users'], talks_count
+            )
+            events = self.step(
+                'мероприятия', self.create_events, kwargs['events']
+            )
+            talks = self.step(
+                'доклады', self.create_talks,
+                events, speakers, kwargs['talks_per_event']
+            )
+            self.step(
+                'вопросы', self.create_questions,
+                talks, guests, kwargs['questions_per_talk']
+            )
+            self.step('голоса', self.create_votes, talks, guests)
+            self.step(
+                'рассылка', self.create_mailing,
+                events[-1], speakers + guests, kwargs['mailing_size']
+            )
+        # Статистика для планировщика SQLite, как на долго живущей базе
+        with connections['default'].cursor() as cursor:
+            self.step('ANALYZE', cursor.execute, 'ANALYZE')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Готово за {elapsed:.1f} с'))
+
+    def step(self, name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f'{name}: {time.perf_counter() - started:.1f} с')
+        return result
+
+    def bulk_create(self, model, objects):
+        created = 0
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+            created += len(batch)
+        return created
+
+    def create_users(self, count, speakers_count):
+        def users():
+            for i in range(count):
+                role = 'speaker' if i < speakers_count else 'guest'
+                name = f'{self.rng.choice(FIRST_NAMES)} {i}'
+                yield CustomUser(
+                    telegram_id=TELEGRAM_ID_BASE + i, name=name, role=role
+                )
+
+        self.bulk_create(CustomUser, users())
+        ids = list(
+            CustomUser.objects.filter(telegram_id__gte=TELEGRAM_ID_BASE)
+            .order_by('telegram_id').values_list('pk', flat=True)
+        )
+        return ids[:speakers_count], ids[speakers_count:]
+
+    def create_events(self, count):
+        # Раз в неделю, последнее идёт в день --date: у бота есть и архив,
+        # и текущая программа
+        today = self.now.replace(hour=10)
+        events = []
+        for i in range(count):
+            start_date = today - timedelta(weeks=count - 1 - i)
+            events.append(Event(
+                title=f'Митап #{i + 1}',
+                description=f'Про {self.rng.choice(TOPICS)} и не только',
+                start_date=start_date,
+                end_date=start_date + timedelta(hours=10),
+            ))
+        return Event.objects.bulk_create(events)
+
+    def create_talks(self, events, speakers, per_event):
+        speakers = iter(speakers)
+        talks = []
+        for event in events:
+            # Два зала: параллельные доклады дают пересечения в расписании
+            slots = [event.start_date, event.start_date]
+            for i in range(per_event):
+                start_time = slots[i % 2]
+                duration = self.rng.choice((20, 30, 40, 45))
+                end_time = start_time + timedelta(minutes=duration)
+                topic = self.rng.choice(TOPICS)
+                slots[i % 2] = end_time + timedelta(minutes=10)
+                talk = Talk(
+                    speaker_id=next(speakers),
+                    title=f'{topic[0].upper()}{topic[1:]}: опыт и выводы',
+                    start_time=start_time,
+                    end_time=end_time,
+                    event=event,
+                )
+                # Сдвиги тянем всегда: поток случайных чисел не зависит
+                # от self.now
+                started_late = timedelta(minutes=self.rng.randint(0, 5))
+                ended_late = timedelta(minutes=self.rng.randint(-5, 10))
+                if end_time < self.now:
+                    talk.actual_start_time = start_time + started_late
+                    talk.actual_end_time = end_time + ended_late
+                talks.append(talk)
+        return Talk.objects.bulk_create(talks, batch_size=self.batch_size)
+
+    def create_questions(self, talks, guests, per_talk):
+        def questions():
+            for talk in talks:
+                duration = talk.end_time - talk.start_time
+                seconds = int(duration.total_seconds())
+                for _ in range(per_talk):
+                    guest_id = self.rng.choice(guests)
+                    template = self.rng.choice(QUESTIONS)
+                    text = template.format(topic=self.rng.choice(TOPICS))
+                    offset = timedelta(seconds=self.rng.randrange(seconds))
+                    # Голоса распределены с длинным хвостом, как в жизни
+                    votes = int(self.rng.paretovariate(1.5)) - 1
+                    yield Question(
+                        talk_id=talk.pk,
+                        guest_id=guest_id,
+                        text=text,
+                        created_at=talk.start_time + offset,
+                        votes_count=min(votes, len(guests)),
+                    )
+
+        with explicit_created_at(Question):
+            created = self.bulk_create(Question, questions())
+        self.stdout.write(f'создано вопросов: {created}')
+
+    def create_votes(self, talks, guests):
+        # На каждый голос в счётчике — строка QuestionVote: save_votes
+        # пересчитывает счётчик по строкам и иначе обнулил бы его
+        questions = list(
+            Question.objects.filter(talk__in=talks, votes_count__gt=0)
+            .order_by('pk')
+            .values_list('pk', 'votes_count', 'created_at')
+        )
+
+        def votes():
+            for question_id, count, created_at in questions:
+                for user_id in self.rng.sample(guests, count):
+                    offset = timedelta(seconds=self.rng.randrange(600))
+                    yield QuestionVote(
+                        question_id=question_id,
+                        user_id=user_id,
+                        created_at=created_at + offset
+                    )
+
+        with explicit_created_at(QuestionVote):
+            created = self.bulk_create(QuestionVote, votes())
+        self.stdout.write(f'создано голосов: {created}')
+
+    def create_mailing(self, event, users, size):
+        mailing = Mailing.objects.create(
+            text=f'Напоминание: {event.title} уже сегодня!', event=event
+        )
+        through = Mailing.users.through
+        recipients = (
+            through(mailing_id=mailing.pk, customuser_id=user_id)
+            for user_id in sorted(self.rng.sample(users, size))
+        )
+        self.bulk_create(through, recipients)
+        return mailing
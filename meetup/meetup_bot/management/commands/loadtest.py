@@ -0,0 +1,193 @@
+from datetime import timedelta
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from aiogram import Bot
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from ... import metrics
+from ...bot import create_dispatcher
+from ...models import CustomUser, Event, Talk
+from ...simulation import (
+    LatencyRecorder,
+    RecordingSession,
+    UpdateFactory,
+    percentiles
+)
+
+
+def seed(talks):
+    now = timezone.now()
+    event = Event.objects.create(
+        title='Нагрузочный тест',
+        start_date=now - timedelta(hours=1),
+        end_date=now + timedelta(hours=8)
+    )
+    speakers = CustomUser.objects.bulk_create(
+        CustomUser(telegram_id=-i, name=f'Спикер {i}', role='speaker')
+        for i in range(1, talks + 1)
+    )
+    return Talk.objects.bulk_create(
+        Talk(
+            speaker=speaker,
+            title=f'Доклад {i}',
+            start_time=now - timedelta(minutes=5),
+            end_time=now + timedelta(hours=1),
+            event=event
+        )
+        for i, speaker in enumerate(speakers)
+    )
+
+
+def guest_updates(factory, telegram_id, talk):
+    name = f'Гость {telegram_id}'
+    question = (
+        f'Вопрос {telegram_id}: что будет дальше с докладом «{talk.title}»?'
+    )
+    return [
+        factory.message(telegram_id, name, '/start'),
+        factory.callback(telegram_id, name, 'register'),
+        factory.callback(telegram_id, name, 'login'),
+        factory.callback(telegram_id, name, 'event_program'),
+        factory.callback(telegram_id, name, f'talk_{talk.pk}'),
+        factory.callback(telegram_id, name, f'ask_question_{talk.pk}'),
+        factory.message(telegram_id, name, question),
+        factory.callback(telegram_id, name, 'back_to_menu'),
+    ]
+
+
+def speaker_updates(factory, talk, *callbacks):
+    speaker = talk.speaker
+    return [
+        factory.callback(speaker.telegram_id, speaker.name, data)
+        for data in callbacks
+    ]
+
+
+def interleave(sequences):
+    # По одному апдейту от каждого пользователя по кругу, как в живом потоке
+    updates = []
+    for step in range(max(map(len, sequences), default=0)):
+        updates.extend(
+            sequence[step] for sequence in sequences if step < len(sequence)
+        )
+    return updates
+
+
+def handler_queries(values, handler):
+    # Запросы хендлера по всем префиксам callback data
+    return sum(
+        count for (name, _), count in values.items() if name == handler
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет синтетические апдейты через Dispatcher без Telegram '
+        'и печатает задержки хендлеров'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--guests', type=int, default=1000)
+        parser.add_argument('--talks', type=int, default=10)
+        parser.add_argument(
+            '--api-latency',
+            type=float,
+            default=0,
+            help='Задержка ответа Bot API, мс'
+        )
+
+    def handle(self, *args, **kwargs):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            talks = seed(kwargs['talks'])
+            api_latency = kwargs['api_latency'] / 1000
+            asyncio.run(self.run(talks, kwargs['guests'], api_latency))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    async def run(self, talks, guests, api_latency):
+        session = RecordingSession(latency=api_latency)
+        bot = Bot(token='1:loadtest', session=session)
+        dp = create_dispatcher()
+        recorder = LatencyRecorder()
+        observers = (dp.message, dp.callback_query, dp.pre_checkout_query)
+        for observer in observers:
+            observer.middleware(recorder)
+        factory = UpdateFactory()
+        phases = [
+            ('спикеры начинают доклады', interleave([
+                speaker_updates(factory, talk, 'login', 'start_talk')
+                for talk in talks
+            ])),
+            ('гости задают вопросы', interleave([
+                guest_updates(
+                    factory, telegram_id, talks[telegram_id % len(talks)]
+                )
+                for telegram_id in range(1, guests + 1)
+            ])),
+            ('спикеры читают вопросы и заканчивают', interleave([
+                speaker_updates(
+                    factory, talk,
+                    'speaker_questions',
+                    'speaker_all_questions',
+                    'speaker_top_questions',
+                    'end_talk'
+                )
+                for talk in talks
+            ])),
+        ]
+        queries_before = dict(metrics.db_queries.values)
+        await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+        total = 0
+        started = time.perf_counter()
+        try:
+            for name, updates in phases:
+                phase_started = time.perf_counter()
+                for update in updates:
+                    await dp.feed_update(
+                        bot, update, dispatcher=dp, bots=[bot]
+                    )
+                await dp.drain()
+                elapsed = time.perf_counter() - phase_started
+                total += len(updates)
+                self.stdout.write(
+                    f'{name}: {len(updates)} апдейтов за {elapsed:.2f} с, '
+                    f'{len(updates) / elapsed:.0f} апд/с'
+                )
+        finally:
+            await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+            await sync_to_async(connections.close_all)()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Всего: {total} апдейтов за {elapsed:.2f} с, '
+            f'{total / elapsed:.0f} апд/с, отброшено {dp.shed}'
+        )
+        self.report(recorder.samples, queries_before)
+        calls = session.calls.most_common()
+        self.stdout.write('Запросы к Bot API: ' + ', '.join(
+            f'{method} {count}' for method, count in calls
+        ))
+
+    def report(self, samples, queries_before):
+        self.stdout.write(
+            f"{'хендлер':<28}{'вызовов':>9}"
+            f"{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"
+            f"{'запросов/вызов':>16}"
+        )
+        rows = sorted(samples.items(), key=lambda item: -sum(item[1]))
+        for handler, latencies in rows:
+            p50, p95, p99 = percentiles(latencies)
+            queries = (
+                handler_queries(metrics.db_queries.values, handler)
+                - handler_queries(queries_before, handler)
+            )
+            self.stdout.write(
+                f'{handler:<28}{len(latencies):>9}'
+                f'{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}{p99 * 1000:>10.2f}'
+                f'{queries / len(latencies):>16.2f}'
+            )
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import Update
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import setup_databases, teardown_databases
+
+from ...bot import create_dispatcher
+from ...models import CustomUser
+from ...simulation import LatencyRecorder, RecordingSession, percentiles
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def senders(records):
+    users = {}
+    for record in records:
+        for event in record['update'].values():
+            if isinstance(event, dict) and 'from' in event:
+                sender = event['from']
+                users[sender['id']] = sender.get('first_name', '')
+    return users
+
+
+class EndToEndLatency(BaseMiddleware):
+    # От момента, когда апдейт должен был прийти по записи,
+    # до конца обработки
+    def __init__(self):
+        self.due = {}
+        self.samples = []
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            due = self.due.pop(event.update_id, None)
+            if due is not None:
+                self.samples.append(time.perf_counter() - due)
+
+
+class Command(BaseCommand):
+    help = (
+        'Воспроизводит записанный поток апдейтов через Dispatcher '
+        'в заданном темпе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Файл, записанный UPDATE_RECORD_PATH'
+        )
+        parser.add_argument(
+            '--speed', type=float, default=1,
+            help=(
+                'Ускорение относительно записи: 1, 10, ...; '
+                '0 — так быстро, как возможно'
+            )
+        )
+        parser.add_argument(
+            '--fixture',
+            action='append',
+            default=[],
+            help='Данные мероприятия для loaddata'
+        )
+        parser.add_argument(
+            '--api-latency',
+            type=float,
+            default=0,
+            help='Задержка ответа Bot API, мс'
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            records = read_records(kwargs['path'])
+        except OSError as err:
+            raise CommandError(err)
+        if not records:
+            raise CommandError('В файле нет апдейтов')
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            if kwargs['fixture']:
+                call_command('loaddata', *kwargs['fixture'], verbosity=0)
+            # id в записи обезличены, поэтому отправители заранее
+            # становятся гостями: иначе все их действия упёрлись бы
+            # в «Вы не зарегистрированы»
+            CustomUser.objects.bulk_create(
+                [
+                    CustomUser(
+                        telegram_id=telegram_id, name=name, role='guest'
+                    )
+                    for telegram_id, name in senders(records).items()
+                ],
+                ignore_conflicts=True
+            )
+            api_latency = kwargs['api_latency'] / 1000
+            asyncio.run(self.run(records, kwargs['speed'], api_latency))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    async def run(self, records, speed, api_latency):
+        session = RecordingSession(latency=api_latency)
+        bot = Bot(token='1:replay', session=session)
+        dp = create_dispatcher()
+        end_to_end = EndToEndLatency()
+        dp.update.outer_middleware(end_to_end)
+        recorder = LatencyRecorder()
+        observers = (dp.message, dp.callback_query, dp.pre_checkout_query)
+        for observer in observers:
+            observer.middleware(recorder)
+        await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot])
+        first = records[0]['t']
+        max_backlog = 0
+        reported_at = started = time.perf_counter()
+        try:
+            for record in records:
+                if speed:
+                    due = started + (record['t'] - first) / speed
+                else:
+                    due = time.perf_counter()
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                update = Update.model_validate(
+                    record['update'], context={'bot': bot}
+                )
+                end_to_end.due[update.update_id] = due
+                await dp.feed_update(
+                    bot, update, dispatcher=dp, bots=[bot]
+                )
+                max_backlog = max(max_backlog, dp.pending)
+                if time.perf_counter() - reported_at >= 1:
+                    reported_at = time.perf_counter()
+                    self.stdout.write(
+                        f'{reported_at - started:6.1f} с: '
+                        f'обработано {len(end_to_end.samples)}, '
+                        f'очередь {dp.pending}'
+                    )
+            await dp.drain()
+        finally:
+            await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot])
+            await sync_to_async(connections.close_all)()
+        elapsed = time.perf_counter() - started
+        recorded = records[-1]['t'] - first
+        self.stdout.write(
+            f'Воспроизведено {len(records)} апдейтов за {elapsed:.2f} с '
+            f'(в записи {recorded:.2f} с), '
+            f'{len(records) / elapsed:.0f} апд/с, '
+            f'максимальная очередь {max_backlog}, отброшено {dp.shed}'
+        )
+        if end_to_end.samples:
+            p50, p95, p99 = percentiles(end_to_end.samples)
+            self.stdout.write(
+                f'Задержка от прихода до ответа: p50 {p50 * 1000:.1f} мс, '
+                f'p95 {p95 * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс'
+            )
+        rows = sorted(
+            recorder.samples.items(), key=lambda item: -sum(item[1])
+        )
+        for handler, latencies in rows:
+            p50, p95, p99 = percentiles(latencies)
+            self.stdout.write(
+                f'  {handler:<28}{len(latencies):>7}'
+                f'  p50 {p50 * 1000:8.2f} мс'
+                f'  p95 {p95 * 1000:8.2f} мс'
+                f'  p99 {p99 * 1000:8.2f} мс'
+            )
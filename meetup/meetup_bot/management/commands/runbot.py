@@ -1,10 +1,31 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 import asyncio
 
-from ...bot import main
+from ...bot import main, set_webhook
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook',
+            action='store_true',
+            help=(
+                'Зарегистрировать webhook вместо polling; апдейты принимает '
+                'meetup.asgi, запущенный одним воркером'
+            )
+        )
+
     def handle(self, *args, **kwargs):
-        asyncio.run(main())
+        if not kwargs['webhook']:
+            asyncio.run(main())
+            return
+        if not settings.WEBHOOK_URL or not settings.WEBHOOK_SECRET:
+            raise CommandError(
+                'Для webhook нужны WEBHOOK_URL и WEBHOOK_SECRET'
+            )
+        asyncio.run(set_webhook())
+        self.stdout.write(self.style.SUCCESS(
+            f'Webhook установлен: {settings.WEBHOOK_URL}'
+        ))
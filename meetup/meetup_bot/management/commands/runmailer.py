@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+import asyncio
+
+from ...mailer import run_mailer
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь рассылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=5)
+
+    def handle(self, *args, **kwargs):
+        asyncio.run(run_mailer(poll_interval=kwargs['poll_interval']))
@@ -0,0 +1,227 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+import hmac
+import threading
+import time
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import CallbackQuery
+from django.db.backends.signals import connection_created
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = []
+
+
+def escape_label(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{escape_label(value)}"'
+        for name, value in zip(names, values)
+    )
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, labels=(), value=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} counter'
+        ]
+        with self._lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            series = format_labels(self.labels, labels)
+            lines.append(f'{self.name}{series} {value}')
+        return lines
+
+
+class Histogram:
+    # Гистограмма Prometheus: на горячем пути только bisect и два сложения
+    def __init__(self, name, description, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                counts = [0] * (len(self.buckets) + 1)
+                series = self.values[labels] = [counts, 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram'
+        ]
+        names = (*self.labels, 'le')
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total))
+                for labels, (counts, total) in self.values.items()
+            )
+        for labels, (counts, total) in values:
+            # В экспозиции бакеты накопительные, последний — +Inf
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                bucket = format_labels(names, (*labels, bound))
+                lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+            series = format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{series} {total}')
+            lines.append(f'{self.name}_count{series} {cumulative}')
+        return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def authorized(header, token):
+    # Prometheus передаёт токен заголовком Authorization: Bearer <token>.
+    # Без токена в настройках метрики закрыты
+    expected = f'Bearer {token}'.encode()
+    return bool(token) and hmac.compare_digest(header.encode(), expected)
+
+
+async def serve(host, port, token):
+    # HTTP-сервер метрик внутри процесса бота: при polling счётчики
+    # живут здесь, а не в процессе Django
+    async def handle(request):
+        header = request.headers.get('Authorization', '')
+        if not authorized(header, token):
+            return web.Response(status=403)
+        return web.Response(
+            body=render().encode(), headers={'Content-Type': CONTENT_TYPE}
+        )
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+handler_seconds = Histogram(
+    'bot_handler_seconds', 'Время обработки апдейта хендлером',
+    ('handler', 'prefix')
+)
+handler_errors = Counter(
+    'bot_handler_errors_total', 'Исключения в хендлерах', ('handler', 'prefix')
+)
+db_queries = Counter(
+    'bot_db_queries_total', 'Запросы к БД по хендлерам',
+    ('handler', 'prefix')
+)
+db_query_seconds = Counter(
+    'bot_db_query_seconds_total', 'Суммарное время запросов к БД по хендлерам',
+    ('handler', 'prefix')
+)
+telegram_seconds = Histogram(
+    'bot_telegram_request_seconds', 'Время запросов к Telegram Bot API',
+    ('method',)
+)
+telegram_errors = Counter(
+    'bot_telegram_request_errors_total', 'Ошибки запросов к Telegram Bot API',
+    ('method',)
+)
+
+# Метки хендлера (имя, префикс callback data), в контексте которого
+# выполняется запрос к БД. sync_to_async переносит контекст в поток,
+# так что запросы ORM попадают к своему хендлеру
+current_labels = ContextVar('current_labels', default=('background', ''))
+
+
+def callback_prefix(event):
+    # Числовые части callback data (id докладов, вопросов) отбрасываем,
+    # чтобы число рядов метрики не росло с данными
+    if isinstance(event, CallbackQuery) and event.data:
+        parts = event.data.split('_')
+        return '_'.join(part for part in parts if not part.isdigit())
+    return type(event).__name__.lower()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    # Внутренний middleware: вызывается, когда хендлер уже выбран
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        labels = (name, callback_prefix(event))
+        token = current_labels.set(labels)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(labels)
+            raise
+        finally:
+            handler_seconds.observe(labels, time.perf_counter() - started)
+            current_labels.reset(token)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        labels = (type(method).__name__,)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            telegram_errors.inc(labels)
+            raise
+        finally:
+            telegram_seconds.observe(labels, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        labels = current_labels.get()
+        db_queries.inc(labels)
+        db_query_seconds.inc(labels, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Сигнал приходит при каждом переподключении одного и того же соединения
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
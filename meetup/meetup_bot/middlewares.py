@@ -0,0 +1,128 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from aiogram import BaseMiddleware
+
+from .models import get_cached_user
+
+
+class UserMiddleware(BaseMiddleware):
+    # Один раз на апдейт находит CustomUser отправителя и передаёт его
+    # в хендлеры аргументом user (None, если пользователь не зарегистрирован)
+    async def __call__(self, handler, event, data):
+        from_user = data.get('event_from_user')
+        if from_user:
+            data['user'] = await get_cached_user(
+                from_user.id, from_user.full_name
+            )
+        return await handler(event, data)
+
+
+# Поля с персональными данными: в записи апдейтов их не сохраняем
+PRIVATE_FIELDS = {
+    'last_name', 'username', 'language_code', 'phone_number', 'email',
+    'bio', 'photo', 'contact', 'location', 'order_info'
+}
+# Сообщение бота, к которому привязана кнопка, несёт чужие данные: имена
+# спикеров, тексты вопросов. Текст заменяем заглушкой той же длины,
+# разметку отбрасываем
+BOT_MESSAGE_TEXT_FIELDS = {'text', 'caption'}
+BOT_MESSAGE_PRIVATE_FIELDS = {'entities', 'caption_entities'}
+# Пользователи и чаты встречаются не только в from и chat: в
+# forward_origin, reply_to_message, via_bot, new_chat_members и т.д.
+# Узнаём их по форме — целый id и поле, которое есть только у User
+# или Chat, — и оставляем лишь поля из PEER_FIELDS
+PEER_MARKERS = {'is_bot', 'type', 'first_name', 'username', 'title'}
+PEER_FIELDS = {'id', 'is_bot', 'type', 'first_name', 'title', 'is_forum'}
+# Подписи пересланных сообщений — имена людей в виде строки
+NAME_FIELDS = {'sender_user_name', 'author_signature'}
+
+
+def pseudonym(value, salt):
+    # Стабильная замена: одно и то же значение в записи — один и тот же
+    # псевдоним
+    digest = hmac.new(salt, str(value).encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:6], 'big') or 1
+
+
+def is_peer(value):
+    return (
+        isinstance(value, dict)
+        and isinstance(value.get('id'), int)
+        and not PEER_MARKERS.isdisjoint(value)
+    )
+
+
+def anonymize_peer(peer, salt):
+    # Знак id сохраняем: отрицательные id — группы и каналы
+    sign = -1 if peer['id'] < 0 else 1
+    alias = pseudonym(abs(peer['id']), salt)
+    result = {key: item for key, item in peer.items() if key in PEER_FIELDS}
+    result['id'] = sign * alias
+    if 'first_name' in result:
+        result['first_name'] = f'user{alias}'
+    if 'title' in result:
+        result['title'] = f'chat{alias}'
+    return result
+
+
+def anonymize_bot_message(message):
+    result = {}
+    for key, item in message.items():
+        if key in BOT_MESSAGE_PRIVATE_FIELDS:
+            continue
+        if key in BOT_MESSAGE_TEXT_FIELDS and isinstance(item, str):
+            item = 'x' * len(item)
+        result[key] = item
+    return result
+
+
+def anonymize(value, salt):
+    if isinstance(value, list):
+        return [anonymize(item, salt) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if is_peer(value):
+        return anonymize_peer(value, salt)
+    result = {}
+    for key, item in value.items():
+        if key in PRIVATE_FIELDS:
+            continue
+        if key == 'chat_instance':
+            item = str(pseudonym(item, salt))
+        if key in NAME_FIELDS and isinstance(item, str):
+            item = f'user{pseudonym(item, salt)}'
+        message = item.get('message') if key == 'callback_query' else None
+        if isinstance(message, dict):
+            item = dict(item, message=anonymize_bot_message(message))
+        result[key] = anonymize(item, salt)
+    return result
+
+
+class UpdateRecorder(BaseMiddleware):
+    # Пишет входящие апдейты без персональных данных в файл JSON Lines:
+    # {"t": время прихода, "update": {...}}. Одна строка — один os.write
+    # в файл с O_APPEND, так что писать могут сразу несколько воркеров
+    def __init__(self, path, salt):
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.salt = salt.encode()
+
+    async def __call__(self, handler, event, data):
+        update = event.model_dump(
+            mode='json', by_alias=True, exclude_none=True
+        )
+        record = {
+            't': data.get('received_at', time.time()),
+            'update': anonymize(update, self.salt),
+        }
+        line = json.dumps(
+            record, ensure_ascii=False, separators=(',', ':')
+        ) + '\n'
+        os.write(self.fd, line.encode())
+        return await handler(event, data)
+
+    async def close(self):
+        os.close(self.fd)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meetup_bot", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="question",
+            name="talk",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="questions",
+                to="meetup_bot.talk",
+            ),
+        ),
+    ]
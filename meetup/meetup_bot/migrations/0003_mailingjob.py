@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meetup_bot", "0002_alter_question_talk"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailingJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "pending"),
+                            ("running", "running"),
+                            ("done", "done"),
+                            ("failed", "failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("cursor", models.BigIntegerField(default=0)),
+                ("locked_by", models.CharField(blank=True, max_length=100)),
+                ("leased_until", models.DateTimeField(blank=True, null=True)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "mailing",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="job",
+                        to="meetup_bot.mailing",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Задача рассылки",
+                "verbose_name_plural": "Задачи рассылки",
+            },
+        ),
+    ]
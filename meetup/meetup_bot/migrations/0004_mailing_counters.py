@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:28
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    Mailing = apps.get_model("meetup_bot", "Mailing")
+    mailings = Mailing.objects.annotate(
+        sent=Count("mailingreport", filter=Q(mailingreport__status="Success")),
+        failed=Count("mailingreport", filter=Q(mailingreport__status="Fail")),
+    )
+    for mailing in mailings:
+        mailing.sent_count = mailing.sent
+        mailing.failed_count = mailing.failed
+        mailing.save(update_fields=["sent_count", "failed_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meetup_bot", "0003_mailingjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="failed_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Ошибок"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="pending_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="В очереди"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="sent_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Доставлено"
+            ),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
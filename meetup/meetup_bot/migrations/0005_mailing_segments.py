@@ -0,0 +1,64 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meetup_bot", "0004_mailing_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailing",
+            name="event",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Для аудитории «Участники мероприятия»",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="meetup_bot.event",
+                verbose_name="Мероприятие",
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="segment",
+            field=models.CharField(
+                choices=[
+                    ("manual", "Выбранные получатели"),
+                    ("all", "Все пользователи"),
+                    ("guests", "Гости"),
+                    ("speakers", "Спикеры"),
+                    ("event", "Участники мероприятия"),
+                    ("talk_askers", "Задавшие вопросы на докладе"),
+                ],
+                default="manual",
+                max_length=20,
+                verbose_name="Аудитория",
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailing",
+            name="talk",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Для аудитории «Задавшие вопросы на докладе»",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="meetup_bot.talk",
+                verbose_name="Доклад",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="mailing",
+            name="users",
+            field=models.ManyToManyField(
+                blank=True,
+                to="meetup_bot.customuser",
+                verbose_name="Получатели",
+            ),
+        ),
+    ]
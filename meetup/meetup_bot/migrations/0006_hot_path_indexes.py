@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meetup_bot", "0005_mailing_segments"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(fields=["role", "id"], name="user_role_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="mailingreport",
+            index=models.Index(
+                fields=["mailing", "user"], name="report_mailing_user_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mailingreport",
+            index=models.Index(
+                fields=["mailing", "status"], name="report_mailing_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="question",
+            index=models.Index(
+                fields=["talk", "created_at", "id"],
+                name="question_talk_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="talk",
+            index=models.Index(
+                fields=["event", "start_time", "id"], name="talk_program_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="talk",
+            index=models.Index(
+                fields=["speaker", "start_time", "end_time"],
+                name="talk_speaker_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="talk",
+            index=models.Index(
+                fields=["end_time", "start_time"], name="talk_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="talk",
+            index=models.Index(
+                condition=models.Q(("actual_end_time__isnull", True)),
+                fields=["actual_start_time", "speaker"],
+                name="talk_live_idx",
+            ),
+        ),
+    ]
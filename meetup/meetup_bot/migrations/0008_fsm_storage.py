@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("meetup_bot", "0007_question_votes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FSMRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=200, unique=True)),
+                (
+                    "state",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("data", models.JSONField(blank=True, default=dict)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
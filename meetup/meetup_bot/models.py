@@ -1,8 +1,15 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.utils import timezone
 
 from asgiref.sync import sync_to_async
 
+from .cache import MISSING, TTLCache
+from .writer import db_writer
+
 
 class CustomUser(models.Model):
     ROLE_CHOICES = [
@@ -22,6 +29,12 @@ class CustomUser(models.Model):
     telegram_id = models.BigIntegerField(unique=True, null=True, blank=True)
     name = models.CharField(max_length=50, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Сегменты рассылок по роли обходятся keyset-пачками по id
+            models.Index(fields=['role', 'id'], name='user_role_idx'),
+        ]
+
     def __str__(self):
         return f'{self.role} {self.name}'
 
@@ -55,6 +68,28 @@ class Talk(models.Model):
         related_name="talks"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['event', 'start_time', 'id'],
+                name='talk_program_idx'
+            ),
+            models.Index(
+                fields=['speaker', 'start_time', 'end_time'],
+                name='talk_speaker_time_idx'
+            ),
+            models.Index(
+                fields=['end_time', 'start_time'],
+                name='talk_time_idx'
+            ),
+            # Идущие доклады: их единицы, частичный индекс почти не весит
+            models.Index(
+                fields=['actual_start_time', 'speaker'],
+                condition=models.Q(actual_end_time__isnull=True),
+                name='talk_live_idx'
+            ),
+        ]
+
     def __str__(self):
         return f"{self.title} by {self.speaker.name}"
 
@@ -72,27 +107,133 @@ class Question(models.Model):
         related_name='guest_questions',
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Пересчитывается из QuestionVote при записи голосов
+    votes_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['talk', 'created_at', 'id'],
+                name='question_talk_created_idx'
+            ),
+        ]
 
     # def __str__(self):
     #     return f"{self.text} by {self.guest.name} to {self.speaker.name}"
 
 
+class QuestionVote(models.Model):
+    question = models.ForeignKey(
+        Question,
+        on_delete=models.CASCADE,
+        related_name='votes'
+    )
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['question', 'user'],
+                name='unique_question_vote'
+            ),
+        ]
+
+
 class Mailing(models.Model):
+    SEGMENTS = [
+        ('manual', 'Выбранные получатели'),
+        ('all', 'Все пользователи'),
+        ('guests', 'Гости'),
+        ('speakers', 'Спикеры'),
+        ('event', 'Участники мероприятия'),
+        ('talk_askers', 'Задавшие вопросы на докладе'),
+    ]
     text = models.TextField(max_length=250)
-    users = models.ManyToManyField(CustomUser, verbose_name="Получатели")
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    segment = models.CharField(
+        max_length=20,
+        choices=SEGMENTS,
+        default='manual',
+        verbose_name="Аудитория"
+    )
+    event = models.ForeignKey(
+        Event,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="Мероприятие",
+        help_text="Для аудитории «Участники мероприятия»"
+    )
+    talk = models.ForeignKey(
+        Talk,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        verbose_name="Доклад",
+        help_text="Для аудитории «Задавшие вопросы на докладе»"
+    )
+    users = models.ManyToManyField(
+        CustomUser,
+        blank=True,
+        verbose_name="Получатели"
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Создано"
+    )
+    # Счётчики доставки обновляет воркер рассылки после каждой записи отчётов
+    sent_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Доставлено"
+    )
+    failed_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Ошибок"
+    )
+    pending_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="В очереди"
+    )
 
     class Meta:
         verbose_name = "Рассылка"
         verbose_name_plural = "Рассылки"
 
     def __str__(self):
-        return f"Рассылка {self.created_at.strftime("%d-%m-%y %H:%M")}"
+        return f"Рассылка {self.created_at.strftime('%d-%m-%y %H:%M')}"
+
+    def clean(self):
+        if self.segment == 'event' and not self.event:
+            raise ValidationError({'event': 'Укажите мероприятие'})
+        if self.segment == 'talk_askers' and not self.talk:
+            raise ValidationError({'talk': 'Укажите доклад'})
+
+    def get_recipients(self):
+        # Получатели как queryset: сегмент разрешается в БД, а не в памяти
+        if self.segment == 'manual':
+            users = self.users.all()
+        elif self.segment == 'guests':
+            users = CustomUser.objects.filter(role='guest')
+        elif self.segment == 'speakers':
+            users = CustomUser.objects.filter(role='speaker')
+        elif self.segment == 'event':
+            speakers = Talk.objects.filter(event=self.event_id)
+            askers = Question.objects.filter(talk__event=self.event_id)
+            users = CustomUser.objects.filter(
+                models.Q(pk__in=speakers.values('speaker'))
+                | models.Q(pk__in=askers.values('guest'))
+            )
+        elif self.segment == 'talk_askers':
+            askers = Question.objects.filter(talk=self.talk_id)
+            users = CustomUser.objects.filter(pk__in=askers.values('guest'))
+        else:
+            users = CustomUser.objects.all()
+        return users.filter(telegram_id__isnull=False)
 
 
 class MailingReport(models.Model):
     STATUSES = [
-        ('Success', 'Success'), 
+        ('Success', 'Success'),
         ('Fail', 'Fail'),
         ('Created', 'Created'),
     ]
@@ -104,33 +245,243 @@ class MailingReport(models.Model):
         default='Created'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['mailing', 'user'],
+                name='report_mailing_user_idx'
+            ),
+            models.Index(
+                fields=['mailing', 'status'],
+                name='report_mailing_status_idx'
+            ),
+        ]
+
+
+class MailingJob(models.Model):
+    STATUSES = [
+        ('pending', 'pending'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+    ]
+    mailing = models.OneToOneField(
+        Mailing,
+        on_delete=models.CASCADE,
+        related_name='job'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default='pending'
+    )
+    # id последнего получателя, до которого рассылка гарантированно дошла
+    cursor = models.BigIntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    leased_until = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
 
-@sync_to_async
-def get_receivers(instance):
-    return list(instance.users.all())
+    class Meta:
+        verbose_name = "Задача рассылки"
+        verbose_name_plural = "Задачи рассылки"
 
+    def __str__(self):
+        return f"{self.mailing} ({self.status})"
 
-@sync_to_async
-def get_users():
-    return list(CustomUser.objects.all())
 
+class FSMRecord(models.Model):
+    # Состояние и данные FSM aiogram, общие для всех процессов бота
+    key = models.CharField(max_length=200, unique=True)
+    state = models.CharField(max_length=100, blank=True, null=True)
+    data = models.JSONField(default=dict, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
 
-@sync_to_async
-def get_user(telegram_id, name):
-    try:
-        user = CustomUser.objects.get(telegram_id=telegram_id, name=name)
+    def __str__(self):
+        return f"{self.key}: {self.state}"
+
+
+def enqueue_mailing(mailing):
+    job, created = MailingJob.objects.get_or_create(mailing=mailing)
+    if not created:
+        # Новые получатели могут оказаться до курсора: проходим список заново,
+        # уже получившие будут пропущены. Аренду снимаем, чтобы воркер, который
+        # сейчас ведёт задачу, не сдвинул курсор обратно и остановился
+        job.status = 'pending'
+        job.cursor = 0
+        job.error = ''
+        job.locked_by = ''
+        job.leased_until = None
+        job.save()
+    Mailing.objects.filter(pk=mailing.pk).update(
+        pending_count=mailing.get_recipients()
+        .exclude(mailingreport__mailing=mailing)
+        .count()
+    )
+    return job
+
+
+# Хелперы доступа к данным. Чтение: один запрос — нативный async ORM,
+# несколько запросов — одна sync-функция, то есть один переход в поток
+# на вызов.
+# Запись идёт через очередь единственного писателя db_writer
+
+
+async def count_mailing_reports(reports):
+    sent = sum(report.status == 'Success' for report in reports)
+    failed = len(reports) - sent
+    await db_writer.write(
+        Mailing.objects.filter(pk=reports[0].mailing_id).update,
+        sent_count=models.F('sent_count') + sent,
+        failed_count=models.F('failed_count') + failed,
+        pending_count=models.Case(
+            models.When(
+                pending_count__gt=len(reports),
+                then=models.F('pending_count') - len(reports)
+            ),
+            default=0
+        )
+    )
+
+
+def _lease_mailing_job(worker, lease_seconds):
+    now = timezone.now()
+    job = MailingJob.objects.filter(
+        models.Q(status='pending')
+        | models.Q(status='running', leased_until__lt=now)
+    ).select_related('mailing').order_by('created_at').first()
+    if not job:
+        return None
+    # Захватываем задачу только если её не успел забрать другой воркер
+    leased = MailingJob.objects.filter(
+        pk=job.pk,
+        status=job.status,
+        leased_until=job.leased_until
+    ).update(
+        status='running',
+        locked_by=worker,
+        leased_until=now + timedelta(seconds=lease_seconds)
+    )
+    if not leased:
+        return None
+    job.status = 'running'
+    job.locked_by = worker
+    return job
+
+
+async def lease_mailing_job(worker, lease_seconds):
+    return await db_writer.write(_lease_mailing_job, worker, lease_seconds)
+
+
+async def advance_mailing_job(job, cursor, lease_seconds):
+    # Сдвигаем курсор и продлеваем аренду; False — задачу перехватил
+    # другой воркер
+    updated = await db_writer.write(
+        MailingJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update,
+        cursor=cursor,
+        leased_until=timezone.now() + timedelta(seconds=lease_seconds)
+    )
+    job.cursor = cursor
+    return bool(updated)
+
+
+async def finish_mailing_job(job, error=''):
+    await db_writer.write(
+        MailingJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update,
+        status='failed' if error else 'done',
+        error=error,
+        leased_until=None,
+        finished_at=timezone.now()
+    )
+
+
+async def get_mailing_chunk(mailing, cursor, size):
+    recipients = (
+        mailing.get_recipients()
+        .filter(pk__gt=cursor)
+        .exclude(mailingreport__mailing=mailing)
+        .order_by('pk')[:size]
+    )
+    return [user async for user in recipients]
+
+
+user_cache = TTLCache(
+    maxsize=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL
+)
+
+
+async def get_cached_user(telegram_id, name):
+    user = user_cache.get(telegram_id)
+    if user is MISSING:
+        users = CustomUser.objects.filter(telegram_id=telegram_id)
+        user = await users.afirst()
+        # Незарегистрированных тоже кэшируем: создание пользователя
+        # сбросит запись
+        user_cache.set(telegram_id, user)
+    if user and user.name == name:
         return user
-    except CustomUser.DoesNotExist:
-        return
+    return None
 
 
-@sync_to_async
-def create_user(telegram_id, name, role):
-    return CustomUser.objects.get_or_create(telegram_id=telegram_id, name=name, role=role)
+async def create_user(telegram_id, name, role):
+    return await db_writer.write(
+        CustomUser.objects.get_or_create,
+        telegram_id=telegram_id,
+        name=name,
+        role=role
+    )
+
+
+def program_page_queryset(event_id, cursor=None, backward=False):
+    # Keyset-страница программы по (start_time, id)
+    talks = Talk.objects.filter(event_id=event_id).only(
+        'id', 'title', 'start_time', 'end_time', 'event_id'
+    )
+    if cursor:
+        anchor = models.Subquery(
+            Talk.objects.filter(pk=cursor).values('start_time')
+        )
+        if backward:
+            talks = talks.filter(
+                models.Q(start_time__lt=anchor)
+                | models.Q(start_time=anchor, pk__lt=cursor)
+            )
+        else:
+            talks = talks.filter(
+                models.Q(start_time__gt=anchor)
+                | models.Q(start_time=anchor, pk__gt=cursor)
+            )
+    if backward:
+        return talks.order_by('-start_time', '-id')
+    return talks.order_by('start_time', 'id')
+
+
+def page_rows(rows, size, cursor, backward):
+    # Читаем size + 1 строк: лишняя показывает, есть ли следующая страница
+    more = len(rows) > size
+    rows = rows[:size]
+    if backward:
+        rows.reverse()
+        return rows, more, True
+    return rows, bool(cursor), more
+
+
+def program_page(event_id, cursor=None, backward=False, size=10):
+    talks = program_page_queryset(event_id, cursor, backward)
+    return page_rows(list(talks[:size + 1]), size, cursor, backward)
+
+
+async def get_program_page(event_id, cursor=None, backward=False, size=10):
+    talks = program_page_queryset(event_id, cursor, backward)
+    rows = [talk async for talk in talks[:size + 1]]
+    return page_rows(rows, size, cursor, backward)
 
 
 @sync_to_async
-def get_program(event_id=None):
+def get_program(event_id=None, size=10):
+    # Мероприятие и первая страница программы за один переход в поток
     if event_id:
         event = Event.objects.get(pk=event_id)
     else:
@@ -140,72 +491,125 @@ def get_program(event_id=None):
             end_date__date__gte=today
         ).first()
     if event:
-        talks = event.talks.all()
-        return event, list(talks)
+        return event, program_page(event.pk, size=size)
     return None, None
 
 
-@sync_to_async
-def get_talk(talk_id):
-    talk = Talk.objects.select_related('speaker').get(pk=talk_id)
-    return talk
-
-
-@sync_to_async
-def get_question(talk_id):
-    question = Question.objects.select_related('title').get(pk=talk_id)
-    return question
-
-
-@sync_to_async
-def create_question(talk_id, name, telegram_id, text):
-    talk = Talk.objects.get(pk=talk_id)
-    user = CustomUser.objects.get(telegram_id=telegram_id, name=name)
-    question = Question.objects.create(talk=talk, guest=user, text=text)
-
-    return talk, user, question
+async def get_talk(talk_id):
+    try:
+        return await Talk.objects.select_related('speaker').aget(pk=talk_id)
+    except Talk.DoesNotExist:
+        return None
 
 
-@sync_to_async
-def start_talk(talk_id):
-    talk = Talk.objects.get(pk=talk_id)
-    talk.actual_start_time = timezone.now()
-    talk.actual_end_time = None
-    talk.save()
+async def start_talk(talk_id):
+    # Один UPDATE без предварительного чтения; post_save обновит расписание
+    talk = Talk(
+        pk=talk_id,
+        actual_start_time=timezone.now(),
+        actual_end_time=None
+    )
+    await db_writer.write(
+        talk.save,
+        update_fields=['actual_start_time', 'actual_end_time']
+    )
     return talk
 
 
-@sync_to_async
-def end_talk(talk_id):
-    talk = Talk.objects.get(pk=talk_id)
-    talk.actual_end_time = timezone.now()
-    talk.save()
-    speaker = talk.speaker
+def _end_talk(talk_id):
+    # Писатель выполняет операцию целиком в одной транзакции
+    talk = Talk(pk=talk_id, actual_end_time=timezone.now())
+    talk.save(update_fields=['actual_end_time'])
+    # Спикер с telegram_id нужен сигналу, сбрасывающему кэш пользователя
+    speaker = CustomUser.objects.filter(talks__pk=talk_id).first()
     speaker.role = 'guest'
-    speaker.save()
+    speaker.save(update_fields=['role'])
     return talk
 
 
-@sync_to_async
-def get_current_talks():
-    now = timezone.now()
-    return list(Talk.objects.select_related('speaker').filter(
-        actual_start_time__isnull=False,
-        actual_end_time__isnull=True,
-        start_time__lte=now,
-        end_time__gte=now
-    ))
+async def end_talk(talk_id):
+    return await db_writer.write(_end_talk, talk_id)
 
 
-@sync_to_async
-def get_speaker_questions(speaker_id):
-    now = timezone.now()
-    talk = Talk.objects.get(
-        speaker_id=speaker_id,
-        start_time__lte=now,
-        end_time__gte=now
+def question_page_queryset(talk_id, cursor=None, backward=False):
+    # Keyset-страница вопросов по (created_at, id) вместе с гостем и докладом
+    questions = Question.objects.select_related('guest', 'talk').filter(
+        talk_id=talk_id
+    )
+    if cursor:
+        anchor = models.Subquery(
+            Question.objects.filter(pk=cursor).values('created_at')
+        )
+        if backward:
+            questions = questions.filter(
+                models.Q(created_at__lt=anchor)
+                | models.Q(created_at=anchor, pk__lt=cursor)
+            )
+        else:
+            questions = questions.filter(
+                models.Q(created_at__gt=anchor)
+                | models.Q(created_at=anchor, pk__gt=cursor)
+            )
+    if backward:
+        return questions.order_by('-created_at', '-id')
+    return questions.order_by('created_at', 'id')
+
+
+async def get_question_page(talk_id, cursor=None, backward=False, size=10):
+    questions = question_page_queryset(talk_id, cursor, backward)[:size + 1]
+    rows = [question async for question in questions]
+    return page_rows(rows, size, cursor, backward)
+
+
+async def load_question_texts(talk_id):
+    questions = Question.objects.filter(talk_id=talk_id).order_by('id')
+    return [row async for row in questions.values_list('id', 'text')]
+
+
+def save_votes(votes, batch_size=500):
+    # Повторные голоса отсекает уникальный индекс, счётчики пересчитываются
+    # одним UPDATE на всю пачку
+    with transaction.atomic():
+        QuestionVote.objects.bulk_create(
+            votes, batch_size=batch_size, ignore_conflicts=True
+        )
+        question_ids = {vote.question_id for vote in votes}
+        Question.objects.filter(pk__in=question_ids).update(
+            votes_count=models.Subquery(
+                QuestionVote.objects.filter(question=models.OuterRef('pk'))
+                .values('question')
+                .annotate(count=models.Count('id'))
+                .values('count')
+            )
+        )
+
+
+async def get_votes_counts(talk_id=None, question_ids=None):
+    questions = Question.objects.all()
+    if talk_id:
+        questions = questions.filter(talk_id=talk_id)
+    if question_ids is not None:
+        questions = questions.filter(pk__in=question_ids)
+    rows = questions.values_list('id', 'talk_id', 'votes_count')
+    return [row async for row in rows]
+
+
+async def get_questions_by_ids(question_ids):
+    return await Question.objects.ain_bulk(question_ids)
+
+
+async def get_new_questions(talk_id, created_at=None, question_id=0, limit=10):
+    # Только вопросы после курсора (created_at, id)
+    questions = Question.objects.select_related('guest', 'talk').filter(
+        talk_id=talk_id
     )
-    return list(talk.questions.select_related('guest').all())
+    if created_at:
+        questions = questions.filter(
+            models.Q(created_at__gt=created_at)
+            | models.Q(created_at=created_at, id__gt=question_id)
+        )
+    questions = questions.order_by('created_at', 'id')[:limit]
+    return [question async for question in questions]
 
 # Мероприятие Event
 # Программа
@@ -0,0 +1,117 @@
+import asyncio
+from collections import defaultdict
+from html import escape
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter
+)
+
+from .keyboards import start_talk_keyboard
+from .schedule import get_schedule
+
+
+logger = logging.getLogger(__name__)
+
+# Telegram не принимает сообщения длиннее 4096 символов
+MESSAGE_LIMIT = 4096
+
+
+def count_fitting(parts, budget):
+    # Сколько первых частей помещается в budget символов
+    total = 0
+    for fitted, part in enumerate(parts):
+        total += len(part)
+        if total > budget:
+            return fitted
+    return len(parts)
+
+
+class QuestionNotifier:
+    # Отправляет спикеру новые вопросы. Поток вопросов склеивается:
+    # в один чат уходит не больше одного сообщения раз в interval секунд
+    def __init__(self, interval=10, limit=20):
+        self.bot = None
+        self.interval = interval
+        self.limit = limit
+        self.pending = defaultdict(list)
+        self.sent_at = {}
+        self._tasks = {}
+
+    async def notify(self, questions):
+        if not self.bot:
+            return
+        schedule = await get_schedule()
+        for question in questions:
+            talk = schedule.talks.get(question.talk_id)
+            if not talk or not talk.speaker.telegram_id:
+                continue
+            chat_id = talk.speaker.telegram_id
+            self.pending[chat_id].append(question)
+            if chat_id not in self._tasks:
+                self._tasks[chat_id] = asyncio.create_task(
+                    self._send_digest(chat_id)
+                )
+
+    async def _send_digest(self, chat_id):
+        questions = []
+        try:
+            sent_at = self.sent_at.get(chat_id, 0)
+            delay = sent_at + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            questions = self.pending.pop(chat_id, [])
+            if not questions:
+                return
+            self.sent_at[chat_id] = time.monotonic()
+            lines = []
+            for question in questions[:self.limit]:
+                name = question.guest.name or 'Без имени'
+                lines.append(
+                    f"— {escape(question.text)} <i>({escape(name)})</i>\n"
+                )
+            # Заголовок и строка «ещё N» укладываются в 100 символов
+            fitted = max(1, count_fitting(lines, MESSAGE_LIMIT - 100))
+            questions, rest = questions[:fitted], questions[fitted:]
+            # Не вошедшие вопросы уйдут следующим сообщением, перед теми,
+            # что придут во время отправки
+            if rest:
+                self.pending[chat_id][:0] = rest
+            text = f"Новые вопросы ({fitted}):\n\n" + ''.join(lines[:fitted])
+            if rest:
+                text += f"\nещё {len(rest)} — в следующем сообщении"
+            await self.bot.send_message(
+                chat_id, text, reply_markup=start_talk_keyboard
+            )
+        except (TelegramBadRequest, TelegramForbiddenError) as err:
+            # Спикер заблокировал бота или чат недоступен: повтор не поможет
+            logger.warning(
+                'Вопросы для чата %s не доставлены: %s', chat_id, err
+            )
+        except TelegramAPIError as err:
+            # Сеть или лимиты Telegram: вопросы вернутся в очередь
+            # и уйдут следующим сообщением
+            logger.warning(
+                'Вопросы для чата %s отложены: %s', chat_id, err
+            )
+            self.pending[chat_id][:0] = questions
+            if isinstance(err, TelegramRetryAfter):
+                self.sent_at[chat_id] = (
+                    time.monotonic() + err.retry_after - self.interval
+                )
+        finally:
+            del self._tasks[chat_id]
+            # Пока отправляли, могли прийти новые вопросы
+            if self.pending.get(chat_id):
+                self._tasks[chat_id] = asyncio.create_task(
+                    self._send_digest(chat_id)
+                )
+
+    async def close(self):
+        self.pending.clear()
+        for task in list(self._tasks.values()):
+            task.cancel()
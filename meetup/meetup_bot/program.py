@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import MISSING, TTLCache
+from .keyboards import (
+    get_program_navigation,
+    get_program_inline_keyboard,
+    get_program_keyboard_for_speaker
+)
+from .models import get_program, get_program_page
+
+
+@dataclass(frozen=True)
+class ProgramPage:
+    talks: tuple
+    guest_keyboard: object
+    speaker_keyboard: object
+
+
+@dataclass(frozen=True)
+class ProgramSnapshot:
+    event: object
+    description: str
+    page: ProgramPage
+
+
+# Снимки программы и её страниц; сбрасываются сигналами Event и Talk
+program_cache = TTLCache(maxsize=1024, ttl=settings.PROGRAM_CACHE_TTL)
+
+
+def build_page(event_id, talks, has_prev, has_next):
+    navigation = get_program_navigation(event_id, talks, has_prev, has_next)
+    return ProgramPage(
+        talks=tuple(talks),
+        guest_keyboard=get_program_inline_keyboard(talks, navigation),
+        speaker_keyboard=get_program_keyboard_for_speaker(talks, navigation)
+    )
+
+
+def build_snapshot(event, page):
+    start_date = timezone.localtime(event.start_date)
+    start_date = start_date.strftime("%d.%m.%Y %H:%M")
+    end_date = timezone.localtime(event.end_date).strftime("%d.%m.%Y %H:%M")
+    description = (
+        f"Мероприятие: {event.title}\n"
+        f"Описание: {event.description}\n"
+        f"Дата начала: {start_date}\n"
+        f"Дата окончания: {end_date}\n\n"
+    )
+    return ProgramSnapshot(
+        event=event,
+        description=description,
+        page=build_page(event.pk, *page)
+    )
+
+
+async def get_program_snapshot(event_id=None):
+    key = event_id or timezone.now().date()
+    snapshot = program_cache.get(key)
+    if snapshot is MISSING:
+        event, page = await get_program(
+            event_id, size=settings.PROGRAM_PAGE_SIZE
+        )
+        snapshot = build_snapshot(event, page) if event else None
+        program_cache.set(key, snapshot)
+    return snapshot
+
+
+async def get_program_page_snapshot(event_id, cursor, backward=False):
+    key = (event_id, cursor, backward)
+    page = program_cache.get(key)
+    if page is MISSING:
+        talks, has_prev, has_next = await get_program_page(
+            event_id, cursor, backward, size=settings.PROGRAM_PAGE_SIZE
+        )
+        if not talks:
+            # Курсорный доклад удалили — возвращаемся к началу программы
+            talks, has_prev, has_next = await get_program_page(
+                event_id, size=settings.PROGRAM_PAGE_SIZE
+            )
+        page = build_page(event_id, talks, has_prev, has_next)
+        program_cache.set(key, page)
+    return page
@@ -0,0 +1,20 @@
+from django.db import connections
+
+
+class ReadWriteRouter:
+    # Чтения идут в соединение readonly, записи и миграции — в default.
+    # Внутри транзакции default читаем из неё же: иначе не увидим свои
+    # незакоммиченные записи (писатель БД читает и пишет в одной транзакции)
+    def db_for_read(self, model, **hints):
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return 'readonly'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,156 @@
+import asyncio
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+import threading
+from time import monotonic
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Talk
+
+
+class ScheduleIndex:
+    # Доклады текущего дня в памяти: отсортированы по плановому началу,
+    # поиск «что идёт сейчас» — бинарный поиск вместо запроса в БД
+    def __init__(self, day, talks):
+        self.day = day
+        self.loaded_at = monotonic()
+        self.talks = {talk.pk: talk for talk in talks}
+        self._lock = threading.Lock()
+        self._reindex()
+
+    def _reindex(self):
+        ordered = sorted(
+            self.talks.values(), key=lambda talk: (talk.start_time, talk.pk)
+        )
+        max_duration = max(
+            (talk.end_time - talk.start_time for talk in ordered),
+            default=timedelta(0)
+        )
+        live = [
+            talk for talk in ordered
+            if talk.actual_start_time and not talk.actual_end_time
+        ]
+        # Одно присваивание, чтобы читатели не увидели наполовину
+        # обновлённый индекс
+        starts = [talk.start_time for talk in ordered]
+        self._index = (starts, ordered, max_duration, live)
+
+    def planned(self, now):
+        starts, ordered, max_duration, _ = self._index
+        lo = bisect_left(starts, now - max_duration)
+        hi = bisect_right(starts, now)
+        return [talk for talk in ordered[lo:hi] if talk.end_time >= now]
+
+    def live(self):
+        return self._index[3]
+
+    def current_talks(self, now):
+        live = {talk.pk for talk in self.live()}
+        return [talk for talk in self.planned(now) if talk.pk in live]
+
+    def speaker_talk(self, speaker_id, now):
+        for talk in self.planned(now):
+            if talk.speaker_id == speaker_id:
+                return talk
+
+    def speaker_live_talk(self, speaker_id):
+        for talk in self.live():
+            if talk.speaker_id == speaker_id:
+                return talk
+
+    def accepting_questions(self, talk_id, now):
+        talk = self.talks.get(talk_id)
+        if talk and talk.actual_start_time and talk.actual_start_time <= now:
+            return talk.actual_end_time is None
+        return False
+
+    def upsert(self, talk):
+        with self._lock:
+            self.talks[talk.pk] = talk
+            self._reindex()
+
+    def update_live(self, talk, fields):
+        with self._lock:
+            indexed = self.talks.get(talk.pk)
+            if not indexed:
+                return False
+            # Сохранённый экземпляр может быть неполным: копируем только
+            # записанные поля
+            for field in fields:
+                setattr(indexed, field, getattr(talk, field))
+            self._reindex()
+            return True
+
+    def remove(self, talk_id):
+        with self._lock:
+            if self.talks.pop(talk_id, None):
+                self._reindex()
+
+
+_schedule = None
+_schedule_lock = asyncio.Lock()
+# Растёт с каждым изменением докладов в этом процессе
+_generation = 0
+
+
+def load_schedule(day):
+    day_start = timezone.make_aware(datetime.combine(day, time.min))
+    day_end = day_start + timedelta(days=1)
+    talks = Talk.objects.select_related('speaker')
+    # Два запроса вместо OR: каждый идёт по своему индексу
+    today = talks.filter(end_time__gte=day_start, start_time__lt=day_end)
+    # Доклады, которые начали раньше, но ещё не закончили
+    live = talks.filter(
+        actual_start_time__isnull=False, actual_end_time__isnull=True
+    )
+    return ScheduleIndex(day, [*today, *live])
+
+
+def is_fresh(schedule, today):
+    # Сигналы обновляют индекс только в своём процессе: правки из админки,
+    # запущенной отдельно, бот увидит не позже SCHEDULE_TTL
+    return (
+        schedule is not None
+        and schedule.day == today
+        and monotonic() - schedule.loaded_at < settings.SCHEDULE_TTL
+    )
+
+
+async def get_schedule():
+    global _schedule
+    today = timezone.localdate()
+    if is_fresh(_schedule, today):
+        return _schedule
+    async with _schedule_lock:
+        while not is_fresh(_schedule, today):
+            generation = _generation
+            schedule = await sync_to_async(load_schedule)(today)
+            # Изменение, пришедшее во время загрузки, могло в неё
+            # не попасть: тогда загружаем ещё раз
+            if generation == _generation:
+                _schedule = schedule
+    return _schedule
+
+
+def on_talk_saved(talk, update_fields=None):
+    global _generation
+    _generation += 1
+    schedule = _schedule
+    if not schedule:
+        return
+    # Начало и конец выступления меняют только фактическое время
+    live_fields = {'actual_start_time', 'actual_end_time'}
+    if update_fields and set(update_fields) <= live_fields:
+        if schedule.update_live(talk, update_fields):
+            return
+    schedule.upsert(Talk.objects.select_related('speaker').get(pk=talk.pk))
+
+
+def on_talk_deleted(talk):
+    global _generation
+    _generation += 1
+    if _schedule:
+        _schedule.remove(talk.pk)
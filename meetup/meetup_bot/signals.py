@@ -0,0 +1,44 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CustomUser, Event, Talk, user_cache
+from .program import program_cache
+from .schedule import on_talk_saved, on_talk_deleted
+
+
+# Смена роли или имени в админке сразу сбрасывает кэш бота.
+# Другие процессы увидят изменения не позже USER_CACHE_TTL.
+# Кэши сбрасываются после коммита: писатель пишет пачками в одной транзакции,
+# и сброшенная раньше запись успела бы снова закэшироваться со старыми данными
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user(sender, instance, **kwargs):
+    if instance.telegram_id:
+        transaction.on_commit(partial(user_cache.delete, instance.telegram_id))
+
+
+# Фактическое начало и конец доклада в программу не попадают
+LIVE_TALK_FIELDS = {'actual_start_time', 'actual_end_time'}
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Talk)
+@receiver(post_delete, sender=Talk)
+def invalidate_program(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= LIVE_TALK_FIELDS:
+        return
+    transaction.on_commit(program_cache.clear)
+
+
+@receiver(post_save, sender=Talk)
+def update_schedule(sender, instance, update_fields=None, **kwargs):
+    transaction.on_commit(partial(on_talk_saved, instance, update_fields))
+
+
+@receiver(post_delete, sender=Talk)
+def remove_from_schedule(sender, instance, **kwargs):
+    transaction.on_commit(partial(on_talk_deleted, instance))
@@ -0,0 +1,107 @@
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime
+from itertools import count
+import statistics
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+
+class RecordingSession(BaseSession):
+    # Сессия бота без сети: запросы к Bot API только считаются,
+    # ответ — правдоподобная заглушка. latency имитирует задержку Telegram
+    def __init__(self, latency=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if getattr(method, '__returning__', None) is bool:
+            return True
+        chat_id = getattr(method, 'chat_id', None) or 0
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type='private')
+        )
+
+    async def stream_content(
+        self,
+        url,
+        headers=None,
+        timeout=30,
+        chunk_size=65536,
+        raise_for_status=True
+    ):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class UpdateFactory:
+    # Синтетические апдейты из личных чатов: id чата совпадает
+    # с id пользователя
+    def __init__(self):
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+
+    def user(self, telegram_id, name):
+        return User(id=telegram_id, is_bot=False, first_name=name)
+
+    def message(self, telegram_id, name, text):
+        return Update(
+            update_id=next(self._update_ids),
+            message=Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=telegram_id, type='private'),
+                from_user=self.user(telegram_id, name),
+                text=text
+            )
+        )
+
+    def callback(self, telegram_id, name, data):
+        update_id = next(self._update_ids)
+        return Update(
+            update_id=update_id,
+            callback_query=CallbackQuery(
+                id=str(update_id),
+                from_user=self.user(telegram_id, name),
+                chat_instance=str(telegram_id),
+                data=data,
+                message=Message(
+                    message_id=next(self._message_ids),
+                    date=datetime.now(),
+                    chat=Chat(id=telegram_id, type='private')
+                )
+            )
+        )
+
+
+class LatencyRecorder(BaseMiddleware):
+    # Внутренний middleware: сырые времена хендлеров для перцентилей
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data['handler'].callback.__name__
+            self.samples[name].append(time.perf_counter() - started)
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return samples * 3
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
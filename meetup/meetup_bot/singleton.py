@@ -0,0 +1,40 @@
+try:
+    import fcntl
+except ImportError:
+    # flock есть только на Unix; на Windows один процесс — забота деплоя
+    fcntl = None
+
+from django.db import connections
+
+
+class ProcessLock:
+    # Кэши бота (пользователи, программа, расписание, голоса, FSM) живут
+    # в памяти процесса, и сигналы моделей сбрасывают их только в нём.
+    # Второй процесс бота над той же БД отдавал бы устаревшие данные,
+    # поэтому на БД допускается один процесс бота: он держит эксклюзивную
+    # блокировку файла рядом с БД, ОС снимет её и при падении процесса
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if fcntl is None or self._file:
+            return
+        path = self.path or (
+            f"{connections['default'].settings_dict['NAME']}.bot-lock"
+        )
+        file = open(path, 'a')
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            raise RuntimeError(
+                f'Бот над этой БД уже запущен другим процессом ({path}). '
+                'Запускайте один процесс runbot или один ASGI-воркер'
+            ) from None
+        self._file = file
+
+    def release(self):
+        if self._file:
+            self._file.close()
+            self._file = None
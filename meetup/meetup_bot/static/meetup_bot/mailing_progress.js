@@ -0,0 +1,28 @@
+// Живой прогресс рассылок в админке: опрашиваем счётчики, пока есть очередь
+(function () {
+    const INTERVAL = 3000;
+
+    function refresh(widget) {
+        fetch(widget.dataset.url, {credentials: 'same-origin'})
+            .then((response) => response.ok ? response.json() : Promise.reject(response))
+            .then((counts) => {
+                const done = counts.sent + counts.failed;
+                const total = done + counts.pending;
+                const bar = widget.querySelector('progress');
+                bar.value = done;
+                bar.max = total || 1;
+                widget.querySelector('span').textContent =
+                    (total ? Math.floor(done * 100 / total) : 100) + '%';
+                if (counts.pending) {
+                    setTimeout(refresh, INTERVAL, widget);
+                }
+            })
+            .catch(() => setTimeout(refresh, INTERVAL * 5, widget));
+    }
+
+    document.addEventListener('DOMContentLoaded', () => {
+        document.querySelectorAll('.mailing-progress').forEach((widget) => {
+            setTimeout(refresh, INTERVAL, widget);
+        });
+    });
+})();
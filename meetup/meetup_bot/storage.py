@@ -0,0 +1,93 @@
+import asyncio
+from copy import deepcopy
+from datetime import timedelta
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from django.utils import timezone
+
+from .cache import MISSING, TTLCache
+from .models import FSMRecord
+from .writer import db_writer
+
+
+class DjangoStorage(BaseStorage):
+    # FSM-хранилище в БД с LRU-кэшем впереди. Бот — единственный процесс,
+    # который пишет состояния (см. ProcessLock), поэтому кэш главный:
+    # запись живёт в памяти столько же, сколько строка в БД, а БД
+    # нужна, чтобы пережить перезапуск и вытеснение из LRU
+    def __init__(self, state_ttl=86400, cache_size=10000):
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self.state_ttl = timedelta(seconds=state_ttl)
+        self.cache = TTLCache(maxsize=cache_size, ttl=state_ttl)
+
+    async def _load(self, key):
+        records = FSMRecord.objects.filter(
+            key=key, expires_at__gt=timezone.now()
+        )
+        record = await records.afirst()
+        if not record:
+            return None, {}
+        return record.state, record.data
+
+    def _save(self, key, state, data):
+        # Пустое состояние не храним: строка удаляется
+        if state is None and not data:
+            FSMRecord.objects.filter(key=key).delete()
+            return
+        FSMRecord.objects.bulk_create(
+            [FSMRecord(
+                key=key,
+                state=state,
+                data=data,
+                expires_at=timezone.now() + self.state_ttl
+            )],
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['state', 'data', 'expires_at']
+        )
+
+    async def _get(self, key):
+        record = self.cache.get(key)
+        if record is MISSING:
+            record = await self._load(key)
+            self.cache.set(key, record)
+        return record
+
+    async def _set(self, key, state, data):
+        # Сквозная запись: память обновляем сразу, следующий апдейт чата
+        # увидит новое состояние, даже если запись в БД ещё в очереди
+        self.cache.set(key, (state, data))
+        await db_writer.write(self._save, key, state, data)
+
+    async def set_state(self, key, state=None):
+        key = self.key_builder.build(key)
+        _, data = await self._get(key)
+        if isinstance(state, State):
+            state = state.state
+        await self._set(key, state, data)
+
+    async def get_state(self, key):
+        state, _ = await self._get(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key, data):
+        key = self.key_builder.build(key)
+        state, _ = await self._get(key)
+        await self._set(key, state, deepcopy(data))
+
+    async def get_data(self, key):
+        _, data = await self._get(self.key_builder.build(key))
+        return deepcopy(data)
+
+    async def collect_garbage(self, interval=3600):
+        while True:
+            deleted, _ = await db_writer.write(
+                FSMRecord.objects.filter(expires_at__lte=timezone.now()).delete
+            )
+            if deleted:
+                print(f'FSM: удалено устаревших состояний {deleted}')
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        pass
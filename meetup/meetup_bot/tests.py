@@ -0,0 +1,923 @@
+import asyncio
+from datetime import timedelta
+import heapq
+import json
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter
+)
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMessage
+from aiogram.types import CallbackQuery, Update
+from aiohttp import ClientSession
+from asgiref.sync import async_to_sync
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings
+)
+from django.utils import timezone
+
+from . import metrics, schedule
+from .broadcast import Broadcast
+from .buffers import WriteBehindBuffer
+from .bot import create_dispatcher, question_votes, show_speaker_questions
+from .dispatcher import OrderedDispatcher
+from .mailer import send_mailing
+from .management.commands.explainqueries import hot_queries
+from .middlewares import anonymize
+from .notifier import MESSAGE_LIMIT, QuestionNotifier
+from .models import (
+    CustomUser,
+    Event,
+    Mailing,
+    MailingJob,
+    MailingReport,
+    Question,
+    Talk,
+    advance_mailing_job,
+    enqueue_mailing,
+    get_cached_user,
+    get_mailing_chunk,
+    get_new_questions,
+    get_program,
+    get_program_page,
+    get_question_page,
+    get_votes_counts,
+    lease_mailing_job,
+    user_cache
+)
+from .program import get_program_snapshot, program_cache
+from .schedule import get_schedule
+from .simulation import RecordingSession, UpdateFactory
+from .singleton import ProcessLock
+from .votes import TalkVotes
+from .webhook import WebhookApp
+from .writer import DatabaseWriter, db_writer
+
+
+class TextSession(RecordingSession):
+    # Запоминает тексты сообщений; fail — исключение на каждый запрос
+    # с текстом, как если бы Telegram его отклонил
+    def __init__(self, fail=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fail = fail
+        self.texts = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if getattr(method, 'text', None):
+            if self.fail:
+                raise self.fail(method, 'message is too long')
+            self.texts.append(method.text)
+        return await super().make_request(bot, method, timeout)
+
+
+class DigestBot:
+    # Бот для QuestionNotifier: первые failures отправок падают по сети
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.texts = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if self.failures:
+            self.failures -= 1
+            raise TelegramNetworkError(None, 'timeout')
+        self.texts.append(text)
+
+
+class BroadcastBot:
+    # Бот для Broadcast и воркера рассылок: запоминает время каждой попытки.
+    # errors — исключения, которые по очереди получат отправки в этот чат
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.attempts = []
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.attempts.append((chat_id, time.monotonic()))
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        self.sent.append(chat_id)
+
+
+def flood_control(seconds):
+    method = SendMessage(chat_id=0, text='')
+    return TelegramRetryAfter(method, 'Too Many Requests', seconds)
+
+
+class BatchWriter(DatabaseWriter):
+    # Запоминает размеры пачек, которые писатель выполняет в одной транзакции
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    def _execute(self, operations):
+        self.batches.append(len(operations))
+        return super()._execute(operations)
+
+
+class HotPathTestCase(TestCase):
+    # Мероприятие сегодня: идущий доклад спикера с вопросами и ещё несколько
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.speaker = CustomUser.objects.create(
+            telegram_id=1, name='Спикер', role='speaker'
+        )
+        cls.guest = CustomUser.objects.create(
+            telegram_id=2, name='Гость', role='guest'
+        )
+        cls.event = Event.objects.create(
+            title='Митап',
+            start_date=now - timedelta(hours=1),
+            end_date=now + timedelta(hours=8)
+        )
+        cls.talk = Talk.objects.create(
+            speaker=cls.speaker,
+            title='Идущий доклад',
+            start_time=now - timedelta(minutes=10),
+            end_time=now + timedelta(minutes=30),
+            actual_start_time=now - timedelta(minutes=5),
+            event=cls.event
+        )
+        for i in range(12):
+            start_time = now + timedelta(hours=1, minutes=10 * i)
+            Talk.objects.create(
+                speaker=cls.speaker,
+                title=f'Доклад {i}',
+                start_time=start_time,
+                end_time=start_time + timedelta(minutes=10),
+                event=cls.event
+            )
+        Question.objects.bulk_create(
+            Question(
+                talk=cls.talk,
+                guest=cls.guest,
+                text=f'Вопрос {i}',
+                votes_count=i % 4
+            )
+            for i in range(25)
+        )
+
+    def setUp(self):
+        # Кэши модульные и переживают тесты: каждый тест начинает с холодных
+        user_cache.clear()
+        program_cache.clear()
+        schedule._schedule = None
+        question_votes.talks.clear()
+
+    def program_talk(self, position):
+        talks = Talk.objects.filter(event=self.event)
+        return talks.order_by('start_time', 'id')[position]
+
+
+class HelperQueryBudgetTests(HotPathTestCase):
+    def test_cached_user(self):
+        with self.assertNumQueries(1):
+            user = async_to_sync(get_cached_user)(1, 'Спикер')
+        with self.assertNumQueries(0):
+            async_to_sync(get_cached_user)(1, 'Спикер')
+        self.assertEqual(user, self.speaker)
+
+    def test_unregistered_user_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(async_to_sync(get_cached_user)(3, 'Никто'))
+            self.assertIsNone(async_to_sync(get_cached_user)(3, 'Никто'))
+
+    def test_program(self):
+        with self.assertNumQueries(2):
+            event, page = async_to_sync(get_program)(size=8)
+        talks, has_prev, has_next = page
+        self.assertEqual(event, self.event)
+        self.assertEqual((len(talks), has_prev, has_next), (8, False, True))
+
+    def test_program_snapshot_is_cached(self):
+        with self.assertNumQueries(2):
+            async_to_sync(get_program_snapshot)()
+        with self.assertNumQueries(0):
+            async_to_sync(get_program_snapshot)()
+
+    def test_program_page(self):
+        cursor = self.program_talk(7).pk
+        with self.assertNumQueries(1):
+            talks, has_prev, has_next = async_to_sync(get_program_page)(
+                self.event.pk, cursor, size=8
+            )
+        self.assertEqual((len(talks), has_prev, has_next), (5, True, False))
+
+    def test_question_page(self):
+        with self.assertNumQueries(1):
+            questions, _, has_next = async_to_sync(get_question_page)(
+                self.talk.pk, size=10
+            )
+        with self.assertNumQueries(1):
+            async_to_sync(get_question_page)(
+                self.talk.pk, questions[-1].pk, size=10
+            )
+        # guest и talk приходят JOIN-ом, а не запросом на каждый вопрос
+        with self.assertNumQueries(0):
+            for question in questions:
+                question.guest.name, question.talk.title
+        self.assertTrue(has_next)
+
+    def test_new_questions(self):
+        with self.assertNumQueries(1):
+            questions = async_to_sync(get_new_questions)(
+                self.talk.pk, limit=10
+            )
+        with self.assertNumQueries(0):
+            for question in questions:
+                question.guest.name, question.talk.title
+        self.assertEqual(len(questions), 10)
+
+    def test_votes_counts(self):
+        with self.assertNumQueries(1):
+            counts = async_to_sync(get_votes_counts)(self.talk.pk)
+        self.assertEqual(len(counts), 25)
+
+    def test_schedule(self):
+        # Два запроса: доклады дня и идущие, каждый по своему индексу
+        with self.assertNumQueries(2):
+            index = async_to_sync(get_schedule)()
+        with self.assertNumQueries(0):
+            async_to_sync(get_schedule)()
+            talks = index.current_talks(timezone.now())
+            for talk in talks:
+                talk.speaker.name
+        self.assertEqual(talks, [self.talk])
+
+    def test_mailing_chunk(self):
+        mailing = Mailing.objects.create(text='Привет', segment='all')
+        with self.assertNumQueries(1):
+            users = async_to_sync(get_mailing_chunk)(mailing, 0, 500)
+        self.assertEqual(users, [self.speaker, self.guest])
+
+
+class HandlerQueryBudgetTests(HotPathTestCase):
+    # Апдейты идут через настоящий Dispatcher, Bot API заменён заглушкой.
+    # Роутер бота подключается только к одному диспетчеру, он общий на класс
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.dp = create_dispatcher()
+
+    def setUp(self):
+        super().setUp()
+        self.dp.storage.cache.clear()
+        self.factory = UpdateFactory()
+
+    def feed(self, *updates):
+        async def run():
+            bot = Bot(token='1:test', session=RecordingSession())
+            for update in updates:
+                await self.dp.feed_update(
+                    bot, update, dispatcher=self.dp, bots=[bot]
+                )
+            await self.dp.drain()
+        async_to_sync(run)()
+
+    def assertBudget(self, user, data, cold, warm):
+        # Первый апдейт заполняет кэши пользователя, FSM и программы,
+        # повторный идёт по ним
+        for queries in (cold, warm):
+            update = self.factory.callback(user.telegram_id, user.name, data)
+            with self.assertNumQueries(queries):
+                self.feed(update)
+
+    def test_login(self):
+        self.assertBudget(self.guest, 'login', 2, 0)
+
+    def test_event_program(self):
+        self.assertBudget(self.guest, 'event_program', 4, 0)
+
+    def test_program_page(self):
+        data = f'program_{self.event.pk}_n_{self.program_talk(7).pk}'
+        self.assertBudget(self.guest, data, 3, 0)
+
+    def test_current_speakers(self):
+        message = self.factory.message(
+            self.guest.telegram_id, self.guest.name, '/current_speakers'
+        )
+        with self.assertNumQueries(4):
+            self.feed(message)
+
+    def test_all_questions(self):
+        self.assertBudget(self.speaker, 'speaker_all_questions', 5, 1)
+
+    def test_question_page(self):
+        cursor = Question.objects.order_by('created_at', 'id')[9].pk
+        data = f'questions_{self.talk.pk}_n_{cursor}'
+        self.assertBudget(self.speaker, data, 5, 1)
+
+    def test_top_questions(self):
+        self.assertBudget(self.speaker, 'speaker_top_questions', 6, 1)
+
+    def test_votes(self):
+        self.assertBudget(self.guest, f'votes_{self.talk.pk}', 6, 1)
+
+    def test_queries_are_labelled_by_prefix(self):
+        # Пользователя и состояние FSM читают middleware до выбора
+        # хендлера, эти два запроса идут в ряд background
+        values = metrics.db_queries.values
+        before = dict(values)
+        self.feed(self.factory.callback(
+            self.guest.telegram_id, self.guest.name, f'votes_{self.talk.pk}'
+        ))
+        queries = {
+            labels: count - before.get(labels, 0)
+            for labels, count in values.items()
+            if count != before.get(labels, 0)
+        }
+        self.assertEqual(
+            queries, {('show_votes', 'votes'): 4, ('background', ''): 2}
+        )
+
+
+class SpeakerQuestionsTests(HotPathTestCase):
+    # Хендлер вызывается напрямую: состояние FSM в памяти, Bot API — заглушка
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # «&» после экранирования впятеро длиннее: десять таких вопросов
+        # не влезают в одно сообщение
+        questions = Question.objects.filter(talk=cls.talk)
+        for n, question in enumerate(questions.order_by('created_at', 'id')):
+            question.text = f'{n:02}' + '&' * 248
+            question.save(update_fields=['text'])
+
+    def setUp(self):
+        super().setUp()
+        self.state = FSMContext(
+            MemoryStorage(), StorageKey(bot_id=1, chat_id=1, user_id=1)
+        )
+
+    def press(self, session):
+        update = UpdateFactory().callback(1, 'Спикер', 'speaker_questions')
+
+        async def run():
+            bot = Bot(token='1:test', session=session)
+            # Объекты, разобранные с bot в контексте, вызывают Bot API сами
+            callback = CallbackQuery.model_validate(
+                update.callback_query.model_dump(), context={'bot': bot}
+            )
+            await show_speaker_questions(callback, self.state, self.speaker)
+        async_to_sync(run)()
+
+    def test_page_fits_in_message(self):
+        session = TextSession()
+        for _ in range(2):
+            self.press(session)
+        first, second = session.texts
+        self.assertLessEqual(len(first), MESSAGE_LIMIT)
+        self.assertEqual(first.count('Идущий доклад'), 1)
+        # Вторая страница начинается с первого не показанного вопроса
+        shown = first.count('<b>Вопрос:</b>')
+        self.assertIn(f'<b>Вопрос:</b> {shown:02}&amp;', second)
+
+    def test_cursor_kept_when_edit_fails(self):
+        with self.assertRaises(TelegramBadRequest):
+            self.press(TextSession(fail=TelegramBadRequest))
+        session = TextSession()
+        self.press(session)
+        self.assertIn('<b>Вопрос:</b> 00&amp;', session.texts[0])
+
+
+class QuestionNotifierTests(SimpleTestCase):
+    def send(self, notifier, chat_id, questions):
+        async def run():
+            notifier.pending[chat_id].extend(questions)
+            notifier._tasks[chat_id] = asyncio.create_task(
+                notifier._send_digest(chat_id)
+            )
+            while notifier._tasks:
+                await asyncio.sleep(0)
+        async_to_sync(run)()
+
+    def questions(self, count):
+        guest = SimpleNamespace(name='Гость')
+        return [
+            SimpleNamespace(text=f'{n:02}' + '&' * 248, guest=guest)
+            for n in range(count)
+        ]
+
+    def test_long_digest_is_split(self):
+        bot = DigestBot()
+        notifier = QuestionNotifier(interval=0)
+        notifier.bot = bot
+        self.send(notifier, 1, self.questions(30))
+        self.assertGreater(len(bot.texts), 1)
+        for text in bot.texts:
+            self.assertLessEqual(len(text), MESSAGE_LIMIT)
+        delivered = ''.join(bot.texts).count('<i>(Гость)</i>')
+        self.assertEqual(delivered, 30)
+
+    def test_failed_digest_is_retried(self):
+        bot = DigestBot(failures=1)
+        notifier = QuestionNotifier(interval=0)
+        notifier.bot = bot
+        self.send(notifier, 1, self.questions(2))
+        self.assertEqual(len(bot.texts), 1)
+        self.assertIn('— 00&amp;', bot.texts[0])
+        self.assertIn('— 01&amp;', bot.texts[0])
+
+
+class WriteBehindBufferTests(TransactionTestCase):
+    # Пишет поток db_writer: тестовой транзакции, которая держала бы
+    # блокировку записи SQLite, здесь нет. Чтения вне транзакции роутер
+    # отправляет в readonly
+    databases = {'default', 'readonly'}
+
+    def test_on_flush_runs_outside_lock(self):
+        flushed = []
+
+        async def on_flush(items):
+            flushed.append(len(items))
+            # Обработчик может сам пополнить и сбросить буфер
+            if len(flushed) == 1:
+                await buffer.add(CustomUser(telegram_id=2, name='Второй'))
+                await buffer.flush()
+
+        buffer = WriteBehindBuffer(CustomUser, on_flush=on_flush)
+
+        async def run():
+            try:
+                await buffer.add(CustomUser(telegram_id=1, name='Первый'))
+                await asyncio.wait_for(buffer.flush(), 5)
+            finally:
+                await db_writer.close()
+        async_to_sync(run)()
+        self.assertEqual(flushed, [1, 1])
+        self.assertEqual(CustomUser.objects.count(), 2)
+
+
+class DatabaseWriterTests(TransactionTestCase):
+    databases = {'default', 'readonly'}
+
+    def test_failed_operation_is_rolled_back_alone(self):
+        def create_and_fail():
+            CustomUser.objects.create(telegram_id=2, name='Второй')
+            raise ValueError('операция упала')
+
+        writer = BatchWriter()
+
+        async def run():
+            try:
+                # Все три операции встают в очередь до первой пачки
+                return await asyncio.gather(
+                    writer.write(
+                        CustomUser.objects.create, telegram_id=1, name='Первый'
+                    ),
+                    writer.write(create_and_fail),
+                    writer.write(
+                        CustomUser.objects.create, telegram_id=3, name='Третий'
+                    ),
+                    return_exceptions=True
+                )
+            finally:
+                await writer.close()
+        first, failed, third = async_to_sync(run)()
+        self.assertEqual(writer.batches, [3])
+        self.assertEqual(first.telegram_id, 1)
+        self.assertIsInstance(failed, ValueError)
+        self.assertEqual(third.telegram_id, 3)
+        self.assertEqual(
+            list(
+                CustomUser.objects.order_by('telegram_id')
+                .values_list('telegram_id', flat=True)
+            ),
+            [1, 3]
+        )
+
+
+class MailingJobTests(TransactionTestCase):
+    databases = {'default', 'readonly'}
+
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create(telegram_id=i, name=f'Гость {i}')
+            for i in range(1, 6)
+        ]
+        self.mailing = Mailing.objects.create(text='Митап уже сегодня')
+        self.mailing.users.set(self.users)
+        enqueue_mailing(self.mailing)
+
+    def run_worker(self, func):
+        async def run():
+            try:
+                return await func()
+            finally:
+                await db_writer.close()
+        return async_to_sync(run)()
+
+    async def expire_lease(self, job):
+        # Воркер упал и аренду не продлевает
+        await db_writer.write(
+            MailingJob.objects.filter(pk=job.pk).update,
+            leased_until=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_lease_is_stolen_only_after_expiry(self):
+        async def run():
+            first = await lease_mailing_job('a', 300)
+            busy = await lease_mailing_job('b', 300)
+            await self.expire_lease(first)
+            second = await lease_mailing_job('b', 300)
+            stale = await advance_mailing_job(first, self.users[0].pk, 300)
+            fresh = await advance_mailing_job(second, self.users[0].pk, 300)
+            return first, busy, second, stale, fresh
+        first, busy, second, stale, fresh = self.run_worker(run)
+        self.assertEqual(first.locked_by, 'a')
+        self.assertIsNone(busy)
+        self.assertEqual(second.locked_by, 'b')
+        # Прежний владелец узнаёт о перехвате и не двигает курсор
+        self.assertFalse(stale)
+        self.assertTrue(fresh)
+
+    @override_settings(MAILING_CHUNK_SIZE=2)
+    def test_crashed_mailing_resumes_from_cursor(self):
+        crashed = BroadcastBot(errors={3: [RuntimeError('воркер упал')]})
+        resumed = BroadcastBot()
+
+        async def run():
+            job = await lease_mailing_job('a', 300)
+            with self.assertRaises(RuntimeError):
+                await send_mailing(crashed, job)
+            await self.expire_lease(job)
+            job = await lease_mailing_job('b', 300)
+            return job.cursor, await send_mailing(resumed, job)
+        cursor, finished = self.run_worker(run)
+        # Первая пачка подтверждена, вторая оборвалась на третьем получателе
+        self.assertEqual(cursor, self.users[1].pk)
+        self.assertTrue(finished)
+        self.assertIn(3, resumed.sent)
+        # Каждый получил рассылку ровно один раз
+        self.assertEqual(sorted(crashed.sent + resumed.sent), [1, 2, 3, 4, 5])
+        self.assertEqual(
+            MailingReport.objects.filter(mailing=self.mailing).count(), 5
+        )
+        job = MailingJob.objects.get(mailing=self.mailing)
+        self.assertEqual(job.cursor, self.users[-1].pk)
+
+
+class TalkVotesTests(SimpleTestCase):
+    def test_top_matches_full_sort(self):
+        # Топ, поправляемый на каждом голосе, совпадает с полной сортировкой
+        rng = random.Random(1)
+        talk = TalkVotes({question_id: 0 for question_id in range(5)}, 3)
+        for question_id in range(5, 300):
+            if rng.random() < 0.1:
+                talk.set(question_id, 0)
+            question_id = rng.choice(list(talk.counts))
+            votes = talk.counts[question_id]
+            # Сверка с БД иногда понижает счётчик
+            if rng.random() < 0.05:
+                talk.set(question_id, max(votes - 2, 0))
+            else:
+                talk.set(question_id, votes + 1)
+            expected = heapq.nsmallest(3, (
+                (-votes, question_id)
+                for question_id, votes in talk.counts.items()
+            ))
+            self.assertEqual(
+                talk.get_top(),
+                [(question_id, -votes) for votes, question_id in expected]
+            )
+
+
+class BroadcastTests(SimpleTestCase):
+    def users(self, count):
+        return [SimpleNamespace(telegram_id=i) for i in range(count)]
+
+    def test_rate_is_limited(self):
+        bot = BroadcastBot()
+        broadcast = Broadcast(bot, rate=20, concurrency=5)
+        started = time.monotonic()
+        async_to_sync(broadcast.send)(self.users(30), 'Привет')
+        # Первые 20 уходят сразу из запаса ведра, остальные 10 — по 20 в
+        # секунду
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+        self.assertEqual(sorted(bot.sent), list(range(30)))
+        self.assertEqual((broadcast.sent, broadcast.failed), (30, 0))
+
+    def test_retry_after_pauses_everyone(self):
+        bot = BroadcastBot(errors={0: [flood_control(0.3)]})
+        broadcast = Broadcast(bot, rate=100, concurrency=5)
+        async_to_sync(broadcast.send)(self.users(5), 'Привет')
+        (chat_id, limited_at), *rest = bot.attempts
+        self.assertEqual(chat_id, 0)
+        # До конца паузы не уходит ни одно сообщение, потом доставлены все
+        self.assertGreaterEqual(
+            min(attempted_at for _, attempted_at in rest) - limited_at, 0.3
+        )
+        self.assertEqual(sorted(bot.sent), list(range(5)))
+        self.assertEqual((broadcast.sent, broadcast.failed), (5, 0))
+
+    def test_failed_delivery_is_reported(self):
+        method = SendMessage(chat_id=1, text='')
+        bot = BroadcastBot(errors={
+            0: [flood_control(0.01) for _ in range(3)],
+            1: [TelegramBadRequest(method, 'chat not found')],
+        })
+        broadcast = Broadcast(bot, rate=100, max_retries=2)
+        results = {}
+
+        async def on_result(user, ok):
+            results[user.telegram_id] = ok
+        async_to_sync(broadcast.send)(self.users(3), 'Привет', on_result)
+        attempts = [chat_id for chat_id, _ in bot.attempts]
+        # Flood control повторяется max_retries раз, остальные ошибки — нет
+        self.assertEqual(attempts.count(0), 3)
+        self.assertEqual(attempts.count(1), 1)
+        self.assertEqual(results, {0: False, 1: False, 2: True})
+        self.assertEqual((broadcast.sent, broadcast.failed), (1, 2))
+
+
+class OrderedDispatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = UpdateFactory()
+        self.handled = []
+
+    def feed(self, dp, updates, release=None):
+        async def run():
+            bot = Bot(token='1:test', session=RecordingSession())
+            for update in updates:
+                await dp.feed_update(bot, update)
+            if release:
+                release.set()
+            await dp.drain()
+        async_to_sync(run)()
+
+    def message(self, chat_id, number):
+        return self.factory.message(chat_id, 'Гость', str(number))
+
+    def test_chat_updates_keep_order(self):
+        dp = OrderedDispatcher()
+        active = set()
+        overlapped = []
+
+        @dp.message()
+        async def handler(message):
+            active.add(message.chat.id)
+            overlapped.append(len(active) > 1)
+            # Ранние апдейты обрабатываются дольше: без очереди чата
+            # поздние их обогнали бы
+            await asyncio.sleep(0.05 / int(message.text))
+            active.discard(message.chat.id)
+            self.handled.append((message.chat.id, int(message.text)))
+        self.feed(dp, [
+            self.message(chat_id, number)
+            for number in range(1, 6) for chat_id in (1, 2)
+        ])
+        for chat_id in (1, 2):
+            self.assertEqual(
+                [number for chat, number in self.handled if chat == chat_id],
+                [1, 2, 3, 4, 5]
+            )
+        # Разные чаты при этом обрабатываются параллельно
+        self.assertTrue(any(overlapped))
+
+    def test_overload_is_shed(self):
+        dp = OrderedDispatcher(
+            chat_backlog=2, max_backlog=3, shed_timeout=0.05
+        )
+        release = asyncio.Event()
+
+        @dp.message()
+        async def handler(message):
+            await release.wait()
+            self.handled.append((message.chat.id, int(message.text)))
+        self.feed(dp, [
+            # Третий апдейт не влезает в очередь чата
+            self.message(1, 1), self.message(1, 2), self.message(1, 3),
+            self.message(2, 1),
+            # Общая очередь занята, место не освобождается за shed_timeout
+            self.message(3, 1),
+        ], release)
+        self.assertEqual(sorted(self.handled), [(1, 1), (1, 2), (2, 1)])
+        self.assertEqual(dp.shed, 2)
+        self.assertEqual(dp.pending, 0)
+
+
+class ProcessLockTests(SimpleTestCase):
+    def test_second_process_is_refused(self):
+        with tempfile.NamedTemporaryFile() as file:
+            first, second = ProcessLock(file.name), ProcessLock(file.name)
+            first.acquire()
+            with self.assertRaises(RuntimeError):
+                second.acquire()
+            first.release()
+            second.acquire()
+            second.release()
+
+
+class LockedWebhookApp(WebhookApp):
+    # Бот уже работает в другом процессе: ProcessLock не даётся
+    async def start(self):
+        raise RuntimeError('Бот уже запущен')
+
+
+class WebhookLifespanTests(SimpleTestCase):
+    def lifespan(self, app):
+        messages = iter([
+            {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}
+        ])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+        async_to_sync(app.lifespan)(receive, send)
+        return sent
+
+    @override_settings(WEBHOOK_URL='', WEBHOOK_SECRET='')
+    def test_bot_is_not_started_without_webhook(self):
+        app = WebhookApp()
+        self.assertEqual(self.lifespan(app), [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete'
+        ])
+        self.assertIsNone(app.dp)
+
+    @override_settings(
+        WEBHOOK_URL='https://example.com/bot/webhook/', WEBHOOK_SECRET='s'
+    )
+    def test_failed_start_is_reported(self):
+        sent = self.lifespan(LockedWebhookApp())
+        self.assertEqual(sent, ['lifespan.startup.failed'])
+
+
+class WebhookSecretTests(SimpleTestCase):
+    def post(self, secret=None):
+        headers = {}
+        if secret is not None:
+            headers['HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN'] = secret
+        # Тело не разбирается: до него доходит только запрос с верным
+        # секретом, и бот при этом не поднимается
+        response = self.client.post(
+            '/bot/webhook/', 'не json', 'application/json', **headers
+        )
+        return response.status_code
+
+    @override_settings(
+        WEBHOOK_URL='https://example.com/bot/webhook/', WEBHOOK_SECRET='s'
+    )
+    def test_secret_is_required(self):
+        self.assertEqual(self.post(), 403)
+        self.assertEqual(self.post('wrong'), 403)
+        self.assertEqual(self.post('s'), 400)
+
+    @override_settings(WEBHOOK_URL='', WEBHOOK_SECRET='')
+    def test_webhook_is_closed_in_polling_mode(self):
+        self.assertEqual(self.post(''), 403)
+
+
+@override_settings(METRICS_TOKEN='token')
+class MetricsAccessTests(SimpleTestCase):
+    def test_bot_process_serves_metrics_by_token(self):
+        async def run():
+            runner = await metrics.serve('127.0.0.1', 0, 'token')
+            _, port = runner.addresses[0]
+            url = f'http://127.0.0.1:{port}/metrics'
+            try:
+                async with ClientSession() as session:
+                    async with session.get(url) as response:
+                        denied = response.status
+                    headers = {'Authorization': 'Bearer token'}
+                    async with session.get(url, headers=headers) as response:
+                        return denied, response.status, await response.text()
+            finally:
+                await runner.cleanup()
+        denied, status, body = async_to_sync(run)()
+        self.assertEqual(denied, 403)
+        self.assertEqual(status, 200)
+        self.assertIn('bot_handler_seconds', body)
+
+    @override_settings(WEBHOOK_URL='', WEBHOOK_SECRET='')
+    def test_django_has_no_metrics_in_polling_mode(self):
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer token'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(
+        WEBHOOK_URL='https://example.com/bot/webhook/', WEBHOOK_SECRET='s'
+    )
+    def test_django_metrics_require_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer wrong'
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            '/metrics/', HTTP_AUTHORIZATION='Bearer token'
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class AnonymizeTests(SimpleTestCase):
+    def test_bot_message_of_callback_is_masked(self):
+        update = UpdateFactory().callback(1, 'Гость', 'votes_1').model_dump(
+            mode='json', by_alias=True, exclude_none=True
+        )
+        update['callback_query']['message'].update(
+            text='Вопрос от Ивана Петрова',
+            entities=[{'type': 'bold', 'offset': 0, 'length': 6}]
+        )
+        message = anonymize(update, b'salt')['callback_query']['message']
+        self.assertEqual(message['text'], 'x' * 23)
+        self.assertNotIn('entities', message)
+        self.assertNotEqual(message['chat']['id'], 1)
+
+    def test_peers_are_pseudonymized_everywhere(self):
+        update = UpdateFactory().message(1, 'Гость', 'Вопрос').model_dump(
+            mode='json', by_alias=True, exclude_none=True
+        )
+        petr = {
+            'id': 424242, 'is_bot': False, 'first_name': 'Petr',
+            'last_name': 'Ivanov', 'username': 'petr_iv'
+        }
+        channel = {'id': -100777, 'type': 'channel', 'title': 'Petr blog'}
+        update['message'].update(
+            forward_origin={
+                'type': 'user', 'date': 0, 'sender_user': petr
+            },
+            sender_chat=channel,
+            via_bot=dict(petr, is_bot=True),
+            new_chat_members=[petr],
+            reply_to_message={
+                'message_id': 1,
+                'date': 0,
+                'chat': channel,
+                'forward_origin': {
+                    'type': 'hidden_user',
+                    'date': 0,
+                    'sender_user_name': 'Petr Ivanov'
+                },
+            }
+        )
+        dump = json.dumps(anonymize(update, b'salt'), ensure_ascii=False)
+        for private in ('424242', '100777', 'Petr', 'Ivanov', 'petr_iv'):
+            self.assertNotIn(private, dump)
+        # Запись по-прежнему разбирается aiogram: её можно воспроизвести
+        message = Update.model_validate(json.loads(dump)).message
+        sender = message.forward_origin.sender_user
+        self.assertEqual(sender.id, message.new_chat_members[0].id)
+        self.assertEqual(sender.first_name, f'user{sender.id}')
+        self.assertEqual(
+            message.sender_chat.id, message.reply_to_message.chat.id
+        )
+        self.assertLess(message.sender_chat.id, 0)
+
+
+class ExplainTests(TestCase):
+    # Горячие запросы идут по индексам из 0006_hot_path_indexes, сегменты
+    # рассылки — ещё и по индексам внешних ключей (имена без хэша)
+    INDEXES = {
+        'программа: первая страница': 'talk_program_idx',
+        'программа: следующая страница': 'talk_program_idx',
+        'программа: предыдущая страница': 'talk_program_idx',
+        'расписание дня': 'talk_time_idx',
+        'идущие доклады': 'talk_live_idx',
+        'доклад спикера сейчас': 'talk_speaker_time_idx',
+        'вопросы: первая страница': 'question_talk_created_idx',
+        'вопросы: следующая страница': 'question_talk_created_idx',
+        'пользователь по telegram_id':
+            'sqlite_autoindex_meetup_bot_customuser_1',
+        'получатели: гости': 'user_role_idx',
+        'получатели: участники мероприятия': 'meetup_bot_question_talk_id',
+        'получатели: авторы вопросов к докладу': 'meetup_bot_question_talk_id',
+        'получатели: выбранные вручную':
+            'meetup_bot_mailing_users_mailing_id_customuser_id',
+    }
+
+    def test_hot_queries_use_indexes(self):
+        queries = hot_queries()
+        self.assertEqual(set(queries), set(self.INDEXES))
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertIn(self.INDEXES[name], plan)
+                # Полный проход таблицы SQLite пишет как «SCAN <таблица>»
+                scans = [
+                    line for line in plan.splitlines()
+                    if ' SCAN ' in f' {line} ' and 'USING' not in line
+                ]
+                self.assertEqual(scans, [])
+
+    def test_recipients_skip_reports_by_index(self):
+        for name, queryset in hot_queries().items():
+            if name.startswith('получатели:'):
+                with self.subTest(name):
+                    plan = queryset.explain()
+                    self.assertIn('report_mailing_user_idx', plan)
@@ -0,0 +1,49 @@
+import hmac
+import json
+
+from django.conf import settings
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import metrics
+from .webhook import webhook
+
+
+@csrf_exempt
+@require_POST
+async def telegram_webhook(request):
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    expected = settings.WEBHOOK_SECRET
+    if not webhook.enabled or not hmac.compare_digest(secret, expected):
+        return HttpResponseForbidden()
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    # Без lifespan (не все ASGI-серверы его шлют) бот поднимается
+    # на первом апдейте
+    await webhook.start()
+    webhook.feed(data)
+    # Отвечаем сразу: обработка идёт в фоне, Telegram не ждёт
+    # и не повторяет апдейт
+    return HttpResponse()
+
+
+@require_GET
+async def prometheus_metrics(request):
+    # Счётчики живут в процессе бота. Здесь он только в webhook-режиме,
+    # при polling метрики отдаёт runbot на METRICS_PORT
+    if not webhook.enabled:
+        raise Http404
+    header = request.headers.get('Authorization', '')
+    if not metrics.authorized(header, settings.METRICS_TOKEN):
+        user = await request.auser()
+        if not user.is_staff:
+            return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,131 @@
+from bisect import bisect_left, insort
+import heapq
+
+from .buffers import WriteBehindBuffer
+from .models import QuestionVote, save_votes, get_votes_counts
+
+
+class VoteBuffer(WriteBehindBuffer):
+    def _write(self, items):
+        save_votes(items, batch_size=self.batch_size)
+
+
+class TalkVotes:
+    # Счётчики голосов одного доклада. Топ вопросов поправляется при каждом
+    # изменении счётчика, а не пересчитывается на каждый показ
+    def __init__(self, counts, size):
+        self.counts = counts
+        self.size = size
+        self.voted = set()
+        self._rebuild()
+
+    def _rebuild(self):
+        # Ключ (-голоса, id): больше голосов выше, при равенстве — старше
+        self.top = heapq.nsmallest(self.size, (
+            (-votes, question_id)
+            for question_id, votes in self.counts.items()
+        ))
+        self.stale = False
+
+    def set(self, question_id, votes):
+        old = self.counts.get(question_id)
+        self.counts[question_id] = votes
+        if old == votes or self.stale:
+            return
+        if old is not None:
+            entry = (-old, question_id)
+            i = bisect_left(self.top, entry)
+            if i < len(self.top) and self.top[i] == entry:
+                if votes < old:
+                    # Вопрос мог уступить место тому, что за пределами топа
+                    self.stale = True
+                    return
+                del self.top[i]
+        entry = (-votes, question_id)
+        if len(self.top) < self.size or entry < self.top[-1]:
+            insort(self.top, entry)
+            del self.top[self.size:]
+
+    def get_top(self):
+        if self.stale:
+            self._rebuild()
+        return [(question_id, -votes) for votes, question_id in self.top]
+
+
+class VoteAggregator:
+    # Голоса за вопросы: дедупликация и счётчики в памяти, в БД — пачками.
+    # После каждой записи счётчики сверяются с пересчитанными в БД.
+    # Состояние держится только по идущим докладам, см. discard
+    def __init__(self, batch_size=500, flush_interval=2.0, top_size=10):
+        self.buffer = VoteBuffer(
+            QuestionVote,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            on_flush=self._refresh
+        )
+        self.top_size = top_size
+        self.talks = {}
+
+    async def _talk(self, talk_id, reload=False):
+        talk = self.talks.get(talk_id)
+        if talk is not None and not reload:
+            return talk
+        counts = {
+            question_id: votes
+            for question_id, _, votes in await get_votes_counts(talk_id)
+        }
+        # Пока шёл запрос, доклад мог загрузить и другой апдейт:
+        # его голоса в памяти не теряем, добавляем только новые вопросы
+        talk = self.talks.get(talk_id)
+        if talk is None:
+            talk = self.talks[talk_id] = TalkVotes(counts, self.top_size)
+        else:
+            for question_id, votes in counts.items():
+                if question_id not in talk.counts:
+                    talk.set(question_id, votes)
+        return talk
+
+    def add_questions(self, questions):
+        for question in questions:
+            talk = self.talks.get(question.talk_id)
+            if talk is not None and question.pk not in talk.counts:
+                talk.set(question.pk, 0)
+
+    async def vote(self, user_id, talk_id, question_id):
+        talk = await self._talk(talk_id)
+        if question_id not in talk.counts:
+            # Вопрос мог записаться уже после загрузки счётчиков доклада
+            talk = await self._talk(talk_id, reload=True)
+            if question_id not in talk.counts:
+                return False
+        key = (user_id, question_id)
+        if key in talk.voted:
+            return False
+        talk.voted.add(key)
+        talk.set(question_id, talk.counts[question_id] + 1)
+        await self.buffer.add(
+            QuestionVote(user_id=user_id, question_id=question_id)
+        )
+        return True
+
+    async def top(self, talk_id):
+        talk = await self._talk(talk_id)
+        return talk.get_top()
+
+    def discard(self, talk_id):
+        # Повторный голос после сброса отсечёт уникальный индекс в БД
+        self.talks.pop(talk_id, None)
+
+    async def _refresh(self, votes):
+        question_ids = {vote.question_id for vote in votes}
+        counts = await get_votes_counts(question_ids=question_ids)
+        for question_id, talk_id, count in counts:
+            talk = self.talks.get(talk_id)
+            if talk is not None:
+                talk.set(question_id, count)
+
+    def start(self):
+        self.buffer.start()
+
+    async def close(self):
+        await self.buffer.close()
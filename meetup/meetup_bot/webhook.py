@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+
+from aiogram.types import Update
+from django.conf import settings
+
+from .bot import create_bot, create_dispatcher
+
+
+class WebhookApp:
+    # Бот внутри ASGI-воркера: апдейты из webhook-вьюхи обрабатываются
+    # фоновыми задачами, ответ Telegram уходит сразу
+    def __init__(self):
+        self.bot = None
+        self.dp = None
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    @property
+    def enabled(self):
+        # Без настроек webhook ASGI-процесс обслуживает только сайт
+        # и админку, а бот работает в runbot
+        return bool(settings.WEBHOOK_URL and settings.WEBHOOK_SECRET)
+
+    async def start(self):
+        async with self._lock:
+            if self.dp:
+                return
+            bot = create_bot()
+            dp = create_dispatcher()
+            # Фоновые задачи бота запускаем вне контекста запроса, см. feed
+            await asyncio.create_task(
+                dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot]),
+                context=contextvars.Context()
+            )
+            self.bot, self.dp = bot, dp
+
+    async def stop(self):
+        if not self.dp:
+            return
+        # Дожидаемся апдейтов, которые уже приняли
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.dp.emit_shutdown(
+            bot=self.bot, dispatcher=self.dp, bots=[self.bot]
+        )
+        await self.bot.session.close()
+        self.dp = None
+
+    def feed(self, data):
+        update = Update.model_validate(data, context={'bot': self.bot})
+        # Пустой контекст: задача переживает запрос и не должна держать
+        # его потоковый контекст, иначе sync_to_async создаст поток
+        # на каждый апдейт
+        task = asyncio.create_task(
+            self.dp.feed_update(
+                self.bot, update, dispatcher=self.dp, bots=[self.bot]
+            ),
+            context=contextvars.Context()
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f'Ошибка обработки апдейта: {task.exception()!r}')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.enabled:
+                        await self.start()
+                except Exception as err:
+                    # Например, бот уже запущен в другом процессе:
+                    # сервер сообщит об ошибке и не примет запросы
+                    await send({
+                        'type': 'lifespan.startup.failed',
+                        'message': repr(err)
+                    })
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+webhook = WebhookApp()
@@ -0,0 +1,119 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+
+class DatabaseWriter:
+    # Единственный писатель SQLite в процессе. Операции записи из корутин
+    # встают в очередь и выполняются в одном потоке пачками: одна транзакция
+    # на пачку, у каждой операции своя точка сохранения. Читатели в WAL
+    # писателя не ждут, а писатели процесса не дерутся за блокировку БД
+    def __init__(self, batch_size=100, queue_size=10000):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.queue = None
+        self._loop = None
+        self._task = None
+        self._executor = None
+
+    def _start(self):
+        loop = asyncio.get_running_loop()
+        if self._task and self._loop is loop:
+            return
+        self._loop = loop
+        self.queue = asyncio.Queue(self.queue_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='db-writer'
+        )
+        # Писатель живёт дольше запроса, который его запустил
+        self._task = loop.create_task(
+            self._run(), context=contextvars.Context()
+        )
+
+    async def write(self, func, *args, **kwargs):
+        self._start()
+        future = self._loop.create_future()
+        # Контекст вызывающего сохраняем, чтобы запросы операции
+        # учитывались в его метриках
+        context = contextvars.copy_context()
+        await self.queue.put((func, args, kwargs, context, future))
+        return await future
+
+    def _execute(self, operations):
+        results = []
+        with transaction.atomic():
+            for func, args, kwargs, context, _ in operations:
+                try:
+                    # Ошибка одной операции откатывает только её
+                    with transaction.atomic():
+                        result = context.run(func, *args, **kwargs)
+                        results.append((True, result))
+                except Exception as err:
+                    results.append((False, err))
+        return results
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            operations = [
+                operation for operation in batch if operation is not None
+            ]
+            if operations:
+                await self._write_batch(operations)
+            if len(operations) < len(batch):
+                return
+
+    async def _write_batch(self, operations):
+        try:
+            results = await self._loop.run_in_executor(
+                self._executor, self._execute, operations
+            )
+        except Exception as err:
+            # Не удалось закоммитить пачку: ошибка достаётся всем операциям
+            results = [(False, err)] * len(operations)
+        for (*_, future), (ok, value) in zip(operations, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def close_old_connections(self):
+        # Пачки выполняются по одной, так что между ними соединение
+        # вне транзакции
+        if self._task:
+            await self._loop.run_in_executor(
+                self._executor, close_old_connections
+            )
+
+    async def close(self):
+        if not self._task:
+            return
+        # None в очереди — сигнал остановки после уже поставленных записей
+        await self.queue.put(None)
+        await self._task
+        await self._loop.run_in_executor(self._executor, connections.close_all)
+        self._executor.shutdown()
+        self._task = None
+
+
+async def maintain_connections(interval):
+    # Django проверяет соединения (CONN_MAX_AGE, CONN_HEALTH_CHECKS) только
+    # на границах HTTP-запроса, у бота и воркера рассылок их нет
+    while True:
+        await asyncio.sleep(interval)
+        await sync_to_async(close_old_connections)()
+        await db_writer.close_old_connections()
+
+
+db_writer = DatabaseWriter(
+    batch_size=settings.DB_WRITER_BATCH_SIZE,
+    queue_size=settings.DB_WRITER_QUEUE_SIZE
+)